@@ -0,0 +1,455 @@
+import threading
+from functools import wraps
+
+import numpy as np
+
+import database
+
+# Histogram bins per group; ratings are 1..10, bin 0 stays empty
+RATING_LEVELS = 11
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# Rows per fetchmany() call while loading
+LOAD_CHUNK_SIZE = 50000
+# Appended ratings are merged into the team index once there are this many
+TEAM_INDEX_TAIL = 65536
+
+def histograms(groups, ratings, n_groups):
+    """Rating counts per group as an (n_groups, RATING_LEVELS) matrix, from a single bincount"""
+    return np.bincount(groups * RATING_LEVELS + ratings,
+                       minlength=n_groups * RATING_LEVELS).reshape(n_groups, RATING_LEVELS)
+
+def summarize(counts, percentiles=PERCENTILES):
+    """Count, mean, std and percentiles for every row of a histogram matrix.
+
+    Ratings only take ten values, so everything follows from the counts without
+    sorting: percentiles interpolate linearly between ranks like numpy.percentile,
+    std is the population std. Empty rows get NaN.
+    """
+    levels = np.arange(RATING_LEVELS)
+    n = counts.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = counts @ levels / n
+        std = np.sqrt(np.maximum(counts @ levels ** 2 / n - mean ** 2, 0))
+    cumulative = counts.cumsum(axis=1)
+    ranks = np.asarray(percentiles) / 100 * (n[:, None] - 1)
+    lower = np.floor(ranks)
+
+    def value_at(rank):
+        # The rating at a 0-based rank is the first bin whose cumulative count exceeds it
+        return (cumulative[:, None, :] > rank[:, :, None]).argmax(axis=2)
+
+    low = value_at(lower)
+    values = low + (ranks - lower) * (value_at(np.ceil(ranks)) - low)
+    values[n == 0] = np.nan
+    return {'count': n, 'mean': mean, 'std': std,
+            **{f'p{p}': values[:, i] for i, p in enumerate(percentiles)}}
+
+def percentile_ranks(values):
+    """Percentile rank of every value among the non-NaN values of its column, ties counted half"""
+    ranks = np.full(values.shape, np.nan)
+    for column in range(values.shape[1]):
+        present = ~np.isnan(values[:, column])
+        ordered = np.sort(values[present, column])
+        below = np.searchsorted(ordered, values[present, column], 'left')
+        equal = np.searchsorted(ordered, values[present, column], 'right') - below
+        ranks[present, column] = (below + 0.5 * equal) / len(ordered) * 100
+    return ranks
+
+class GrowableArray:
+    """Append-only NumPy array; capacity doubles, so appends are amortised O(1)"""
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        size = self.size + len(values)
+        if size > len(self._data):
+            grown = np.empty(max(size, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:size] = values
+        self.size = size
+
+    @property
+    def values(self):
+        return self._data[:self.size]
+
+def parse_timestamps(timestamps):
+    """Stored 'YYYY-MM-DD HH:MM:SS' strings as datetime64[s]; anything else becomes NaT"""
+    try:
+        return np.array(timestamps, dtype='datetime64[s]')
+    except ValueError:
+        parsed = []
+        for timestamp in timestamps:
+            try:
+                parsed.append(np.datetime64(timestamp, 's'))
+            except (TypeError, ValueError):
+                parsed.append(np.datetime64('NaT'))
+        return np.array(parsed, dtype='datetime64[s]')
+
+def locked(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class SurveySnapshot:
+    """Process-wide copy of the responses and ratings tables as integer-coded NumPy arrays.
+
+    Roles, categories and questions get codes from the survey config (ones only
+    found in the database are appended), teams get codes in order of appearance.
+    A rating takes 11 bytes (response id, question, team, rating) plus 4 for the
+    team index, instead of a sqlite3.Row per row. refresh() appends whatever has
+    been inserted since the last seen rowids; both tables are append-only.
+
+    Any group-by is a bincount over a combined code. Results are memoised per
+    scope until the next refresh that finds new rows.
+    """
+    def __init__(self, survey_config):
+        self.roles = []
+        self.categories = []
+        self.questions = []
+        self._role_codes = {}
+        self._category_codes = {}
+        self._question_codes = {}
+        # question code -> role code, category code
+        self._question_roles = []
+        self._question_categories = []
+        for role in survey_config['roles']:
+            self._code(self._role_codes, self.roles, role)
+        for category in survey_config['categories']:
+            self._code(self._category_codes, self.categories, category)
+        for role in self.roles:
+            for category, questions in survey_config.get(role, {}).items():
+                for question in questions:
+                    self._question_code((role, category, question))
+        # team code -> team id as stored (?t= that isn't an integer stays text); no ?t= is NO_TEAM
+        self.teams = []
+        self._team_codes = {}
+
+        self.rating_response = GrowableArray(np.int32)
+        self.rating_question = GrowableArray(np.int16)
+        self.rating_team = GrowableArray(np.int32)
+        self.rating = GrowableArray(np.int8)
+
+        self.response_id = GrowableArray(np.int32)
+        self.response_team = GrowableArray(np.int32)
+        self.response_role = GrowableArray(np.int16)
+        self.response_time = GrowableArray('datetime64[s]')
+        self.response_open_count = GrowableArray(np.int32)
+
+        self.last_response_id = 0
+        self.last_question_id = 0
+        self.last_rating_id = 0
+        # questions.id -> question code (-1 for ids not seen yet)
+        self._question_id_codes = np.full(1, -1, dtype=np.int16)
+        # Bumped by every refresh that finds new rows
+        self.version = 0
+        self.lock = threading.RLock()
+
+        # Rating positions ordered by team for the first _indexed ratings;
+        # later ones are scanned until they are merged in
+        self._indexed = 0
+        self._team_order = np.empty(0, dtype=np.int32)
+        self._team_bounds = np.zeros(1, dtype=np.int64)
+        self._results = {}
+
+    def _code(self, codes, values, value):
+        if value not in codes:
+            codes[value] = len(values)
+            values.append(value)
+        return codes[value]
+
+    def _question_code(self, key):
+        if key not in self._question_codes:
+            role, category, _ = key
+            self._question_roles.append(self._code(self._role_codes, self.roles, role))
+            self._question_categories.append(self._code(self._category_codes, self.categories, category))
+        return self._code(self._question_codes, self.questions, key)
+
+    def _team_code(self, team_id):
+        return self._code(self._team_codes, self.teams, team_id)
+
+    def __len__(self):
+        return self.rating.size
+
+    @property
+    def question_role(self):
+        return np.array(self._question_roles, dtype=np.int16)
+
+    @property
+    def question_category(self):
+        return np.array(self._question_categories, dtype=np.int16)
+
+    @locked
+    def refresh(self, conn, chunk_size=LOAD_CHUNK_SIZE):
+        """Append responses and ratings inserted since the last refresh; True if there were any"""
+        cursor = conn.cursor()
+        cursor.row_factory = None  # plain tuples, noticeably faster for millions of rows
+        # One read transaction, so every new rating's response is seen as well
+        began = not conn.in_transaction
+        if began:
+            cursor.execute('BEGIN')
+        try:
+            # Teams come from ?t= as typed, so main.snapshot_team() looks them up the same way
+            cursor.execute('''SELECT id, COALESCE(team_id, ?), role, timestamp, open_count
+                              FROM responses WHERE id > ? ORDER BY id''',
+                           (database.NO_TEAM, self.last_response_id))
+            new_responses = self._append_responses(cursor, chunk_size)
+            cursor.execute('SELECT id, role, category, question FROM questions WHERE id > ? ORDER BY id',
+                           (self.last_question_id,))
+            self._append_questions(cursor.fetchall())
+            cursor.execute('''SELECT id, response_id, question_id, rating
+                              FROM ratings
+                              WHERE id > ? AND rating BETWEEN 1 AND 10
+                              AND response_id IS NOT NULL AND question_id IS NOT NULL
+                              ORDER BY id''', (self.last_rating_id,))
+            new_ratings = self._append_ratings(cursor, chunk_size)
+        finally:
+            if began:
+                conn.rollback()
+        if new_responses or new_ratings:
+            self.version += 1
+            self._results = {}
+            if len(self) - self._indexed >= TEAM_INDEX_TAIL:
+                self._build_team_index()
+        return bool(new_responses or new_ratings)
+
+    def _append_responses(self, cursor, chunk_size):
+        count = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return count
+            self.response_id.extend(np.fromiter((row[0] for row in rows), np.int32, len(rows)))
+            self.response_team.extend(np.fromiter((self._team_code(row[1]) for row in rows), np.int32, len(rows)))
+            self.response_role.extend(np.fromiter((self._code(self._role_codes, self.roles, row[2])
+                                                   for row in rows), np.int16, len(rows)))
+            self.response_time.extend(parse_timestamps([row[3] for row in rows]))
+            self.response_open_count.extend(np.fromiter((row[4] or 0 for row in rows), np.int32, len(rows)))
+            self.last_response_id = rows[-1][0]
+            count += len(rows)
+
+    def _append_questions(self, rows):
+        if not rows:
+            return
+        self.last_question_id = rows[-1][0]
+        codes = np.full(self.last_question_id + 1, -1, dtype=np.int16)
+        codes[:len(self._question_id_codes)] = self._question_id_codes
+        for question_id, role, category, question in rows:
+            codes[question_id] = self._question_code((role, category, question))
+        self._question_id_codes = codes
+
+    def _append_ratings(self, cursor, chunk_size):
+        count = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return count
+            numbers = np.array(rows, dtype=np.int64)
+            self.last_rating_id = int(numbers[-1, 0])
+            # Question ids are dense and few, so a lookup array maps them to codes
+            question = self._question_id_codes[np.clip(numbers[:, 2], 0, len(self._question_id_codes) - 1)]
+            valid = question >= 0
+            question = question[valid]
+            response_ids = numbers[valid, 1]
+            # Each rating's team is its response's; responses are sorted by id
+            team = np.empty(len(response_ids), dtype=np.int32)
+            found = np.zeros(len(response_ids), dtype=bool)
+            seen = self.response_id.values
+            if len(seen):
+                positions = np.minimum(np.searchsorted(seen, response_ids), len(seen) - 1)
+                found = seen[positions] == response_ids
+                team[found] = self.response_team.values[positions[found]]
+            if not found.all():
+                team[~found] = self._team_code(database.NO_TEAM)
+            self.rating_response.extend(response_ids)
+            self.rating_question.extend(question)
+            self.rating_team.extend(team)
+            self.rating.extend(numbers[valid, 3])
+            count += len(rows)
+
+    def _build_team_index(self):
+        teams = self.rating_team.values
+        self._team_order = np.argsort(teams, kind='stable').astype(np.int32)
+        self._team_bounds = np.concatenate([[0], np.cumsum(np.bincount(teams, minlength=len(self.teams)))])
+        self._indexed = len(teams)
+
+    def _select(self, team_id=None, role=None):
+        """Positions of the ratings of one team and/or role (None selects everything)"""
+        if team_id is None:
+            positions = np.arange(len(self))
+        else:
+            code = self._team_codes.get(team_id)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            indexed = self._team_order[self._team_bounds[code]:self._team_bounds[code + 1]] \
+                if code + 1 < len(self._team_bounds) else np.empty(0, dtype=np.int32)
+            tail = self._indexed + np.flatnonzero(self.rating_team.values[self._indexed:] == code)
+            positions = np.concatenate([indexed, tail])
+        if role is not None:
+            code = self._role_codes.get(role, -1)
+            positions = positions[self.question_role[self.rating_question.values[positions]] == code]
+        return positions
+
+    def _cached(self, key, compute, team_id=None, role=None):
+        # Teams and roles come from URLs; results for ones without ratings are empty and
+        # cheap, and aren't kept, so the memo can't grow past the teams that exist
+        if (team_id is not None and team_id not in self._team_codes) or \
+                (role is not None and role not in self._role_codes):
+            return compute()
+        if key not in self._results:
+            self._results[key] = compute()
+        return self._results[key]
+
+    @locked
+    def question_stats(self, team_id=None, role=None):
+        """Distribution of every answered question in scope, in order of question code"""
+        return self._cached(('questions', team_id, role), lambda: self._question_stats(team_id, role),
+                            team_id, role)
+
+    def _question_stats(self, team_id, role):
+        positions = self._select(team_id, role)
+        summary = summarize(histograms(self.rating_question.values[positions].astype(np.int64),
+                                       self.rating.values[positions], len(self.questions)))
+        rows = []
+        for code in np.flatnonzero(summary['count']):
+            q_role, category, question = self.questions[code]
+            rows.append({'role': q_role, 'category': category, 'question': question,
+                         **{key: values[code].item() for key, values in summary.items()}})
+        return rows
+
+    def _cells(self, positions):
+        """Combined (role, category) code of the ratings at positions"""
+        question = self.rating_question.values[positions]
+        return self.question_role[question].astype(np.int64) * len(self.categories) + self.question_category[question]
+
+    @locked
+    def category_means(self, team_id=None):
+        """(sums, counts) matrices of shape (roles, categories) for one team or everyone"""
+        return self._cached(('categories', team_id), lambda: self._category_means(self._select(team_id)),
+                            team_id)
+
+    def _category_means(self, positions):
+        shape = (len(self.roles), len(self.categories))
+        size = shape[0] * shape[1]
+        cells = self._cells(positions)
+        sums = np.bincount(cells, weights=self.rating.values[positions], minlength=size).reshape(shape)
+        counts = np.bincount(cells, minlength=size).reshape(shape)
+        return sums, counts
+
+    @locked
+    def role_gap(self, first, second, team_id=None):
+        """Per category: average of each of two roles and first minus second (none if either is unknown)"""
+        if first not in self.roles or second not in self.roles:
+            return []
+        sums, counts = self.category_means(team_id)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        a, b = self.roles.index(first), self.roles.index(second)
+        return [{'category': category, 'first_avg': means[a, i].item(), 'second_avg': means[b, i].item(),
+                 'gap': (means[a, i] - means[b, i]).item()}
+                for i, category in enumerate(self.categories)
+                if counts[a, i] and counts[b, i]]
+
+    def _team_cells(self):
+        """(sums, counts) arrays of shape (teams, roles, categories)"""
+        n_cells = len(self.roles) * len(self.categories)
+        cells = self.rating_team.values.astype(np.int64) * n_cells + self._cells(slice(None))
+        shape = (len(self.teams), len(self.roles), len(self.categories))
+        sums = np.bincount(cells, weights=self.rating.values, minlength=len(self.teams) * n_cells).reshape(shape)
+        counts = np.bincount(cells, minlength=len(self.teams) * n_cells).reshape(shape)
+        return sums, counts
+
+    @locked
+    def team_comparison(self, first, second):
+        """Every team side by side, from one pass over the ratings and one over the responses.
+
+        One dict per team (responses without a team left out) with its response
+        count per role, the id of its newest response, its average per category
+        over all roles and per role, the first minus second role gap, and its
+        percentile rank among the teams that answered each category. The index is
+        the mean of the team's category averages, ranked the same way.
+        """
+        return self._cached(('teams', first, second), lambda: self._team_comparison(first, second))
+
+    def _team_comparison(self, first, second):
+        sums, counts = self._team_cells()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            role_means = sums / counts
+            means = sums.sum(axis=1) / counts.sum(axis=1)
+            answered = ~np.isnan(means)
+            index = np.where(answered, means, 0).sum(axis=1) / answered.sum(axis=1)
+        if first in self.roles and second in self.roles:
+            gap = role_means[:, self.roles.index(first)] - role_means[:, self.roles.index(second)]
+        else:
+            gap = np.full(means.shape, np.nan)
+
+        n_roles = len(self.roles)
+        team = self.response_team.values.astype(np.int64)
+        responses = np.bincount(team * n_roles + self.response_role.values,
+                                minlength=len(self.teams) * n_roles).reshape(len(self.teams), n_roles)
+        last_response = np.zeros(len(self.teams), dtype=np.int64)
+        np.maximum.at(last_response, team, self.response_id.values)
+
+        in_comparison = np.array([team_id != database.NO_TEAM for team_id in self.teams], dtype=bool)
+        in_comparison &= responses.sum(axis=1) > 0
+        ranks = percentile_ranks(np.where(in_comparison[:, None], means, np.nan))
+        index_ranks = percentile_ranks(np.where(in_comparison, index, np.nan)[:, None])[:, 0]
+
+        def value(x):
+            return None if np.isnan(x) else x.item()
+
+        rows = []
+        for t in np.flatnonzero(in_comparison):
+            rows.append({'team_id': self.teams[t],
+                         'responses': {self.roles[r]: int(responses[t, r]) for r in np.flatnonzero(responses[t])},
+                         'last_response_id': int(last_response[t]),
+                         'categories': {category: value(means[t, c]) for c, category in enumerate(self.categories)},
+                         'roles': {role: {category: value(role_means[t, r, c])
+                                          for c, category in enumerate(self.categories)}
+                                   for r, role in enumerate(self.roles) if responses[t, r]},
+                         'gap': {category: value(gap[t, c]) for c, category in enumerate(self.categories)},
+                         'percentile': {category: value(ranks[t, c]) for c, category in enumerate(self.categories)},
+                         'index': value(index[t]),
+                         'index_percentile': value(index_ranks[t])})
+        return rows
+
+    @locked
+    def team_deltas(self, team_id):
+        """Per role and category: the team's average, the company's and the difference"""
+        team_sums, team_counts = self.category_means(team_id)
+        sums, counts = self.category_means()
+        rows = []
+        for (r, c), team_count in np.ndenumerate(team_counts):
+            if team_count:
+                team_avg = team_sums[r, c] / team_count
+                company_avg = sums[r, c] / counts[r, c]
+                rows.append({'role': self.roles[r], 'category': self.categories[c],
+                             'team_avg': team_avg.item(), 'company_avg': company_avg.item(),
+                             'delta': (team_avg - company_avg).item()})
+        return rows
+
+    @locked
+    def response_stats(self, team_id=None):
+        """Per role: number of responses and newest timestamp, plus the open answer total"""
+        return self._cached(('responses', team_id), lambda: self._response_stats(team_id), team_id)
+
+    def _response_stats(self, team_id):
+        if team_id is None:
+            selected = slice(None)
+        else:
+            code = self._team_codes.get(team_id)
+            selected = self.response_team.values == (-1 if code is None else code)
+        roles = self.response_role.values[selected]
+        times = self.response_time.values[selected]
+        counts = np.bincount(roles, minlength=len(self.roles))
+        role_rows = {}
+        for code in np.flatnonzero(counts):
+            role_times = times[roles == code]
+            role_times = role_times[~np.isnat(role_times)]
+            last = str(role_times.max()).replace('T', ' ') if len(role_times) else None
+            role_rows[self.roles[code]] = {'response_count': int(counts[code]), 'last_timestamp': last}
+        return role_rows, int(self.response_open_count.values[selected].sum())
@@ -0,0 +1,97 @@
+"""Charts per second of the template-based renderer against the original pyplot one.
+
+Also measures the process render pool, which is what the app uses to draw the
+charts of one dashboard in parallel.
+
+    python benchmarks/chart_rendering.py --charts 50 --workers 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import charts
+
+LABELS = ['Целеполагание', 'Взаимодействие', 'Роли и вклад', 'Технологичность', 'Нормы и культура']
+TITLE = 'Средние результаты - Руководитель'
+
+def pyplot_spider_chart(values, labels, title, fmt='png'):
+    """The renderer as it was before charts.py: a fresh pyplot figure per chart"""
+    N = len(labels)
+    angles = [n / float(N) * 2 * np.pi for n in range(N)]
+    angles += angles[:1]
+    values = list(values) + values[:1]
+    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(projection='polar'))
+    ax.plot(angles, values, 'o-', linewidth=2, color='blue')
+    ax.fill(angles, values, alpha=0.25, color='blue')
+    ax.set_xticks(angles[:-1])
+    ax.set_xticklabels([charts.CATEG_FORMAT.format(label, f"{values[i]:.1f}")
+                        for i, label in enumerate(labels)], size=10)
+    ax.set_ylim(0, 10)
+    ax.set_yticks(range(0, 11, 2))
+    ax.set_yticklabels(map(str, range(0, 11, 2)), size=8)
+    ax.grid(True)
+    plt.title(charts.TITLE_FORMAT.format(title, f"{sum(values)/len(values):.1f}"), size=15, y=1.1)
+    img = BytesIO()
+    plt.savefig(img, format=fmt, dpi=100, bbox_inches='tight')
+    plt.close(fig)
+    return img.getvalue()
+
+def run(render, charts_count, fmt):
+    sizes = []
+    start = time.perf_counter()
+    for _ in range(charts_count):
+        values = [round(random.uniform(1, 10), 1) for _ in LABELS]
+        sizes.append(len(render(values, LABELS, TITLE, fmt)))
+    elapsed = time.perf_counter() - start
+    return charts_count / elapsed, sum(sizes) / len(sizes)
+
+def render_many(pool, jobs):
+    """Submit (key, values, labels, title, fmt) jobs all at once, as a dashboard does; images in order"""
+    futures = [pool.submit(*job) for job in jobs]
+    return [future.result() for future in futures]
+
+def run_pool(workers, charts_count):
+    pool = charts.ChartRenderPool(charts.ChartCache(max_entries=0), workers)
+    # Let every worker start and build its template before timing
+    render_many(pool, [(f'warmup-{i}', [5] * len(LABELS), LABELS, f'{TITLE} {i}', 'png')
+                            for i in range(max(workers, 1) * 2)])
+    jobs = [(f'chart-{i}', [round(random.uniform(1, 10), 1) for _ in LABELS], LABELS, TITLE, 'png')
+            for i in range(charts_count)]
+    start = time.perf_counter()
+    render_many(pool, jobs)
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    return charts_count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--charts', type=int, default=50, help='charts per run (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=4, help='render pool size (default: %(default)s)')
+    args = parser.parse_args()
+    random.seed(42)
+
+    # Build the template up front, as a running app would have already done
+    charts.render_spider_chart([5] * len(LABELS), LABELS, TITLE)
+    for fmt in ('png', 'svg'):
+        old_rate, old_size = run(pyplot_spider_chart, args.charts, fmt)
+        new_rate, new_size = run(charts.render_spider_chart, args.charts, fmt)
+        print(f'{fmt}: pyplot {old_rate:7.1f} charts/s ({old_size / 1024:.0f} KB)   '
+              f'template {new_rate:7.1f} charts/s ({new_size / 1024:.0f} KB)   '
+              f'{new_rate / old_rate:.1f}x')
+
+    in_process = run_pool(0, args.charts)
+    pooled = run_pool(args.workers, args.charts)
+    print(f'png render pool: in-process {in_process:7.1f} charts/s   '
+          f'{args.workers} workers {pooled:7.1f} charts/s   {pooled / in_process:.1f}x')
+
+if __name__ == '__main__':
+    main()
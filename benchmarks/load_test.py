@@ -0,0 +1,362 @@
+"""Throughput and latency of the app's main endpoints, plus chart and aggregate micro-benchmarks.
+
+Creates a synthetic survey.db from config/survey_config.json (every role, every
+question), imports the real app against it and drives /survey/<role>, /submit,
+/spider, /admin, /group?t= and /role/<role> from concurrent clients, either
+through Flask's test client or over HTTP to a local WSGI server. Results are written as JSON, and a
+previous run can be passed to --compare to flag regressions.
+
+    python benchmarks/load_test.py --teams 200 --respondents 25 --json run.json
+    python benchmarks/load_test.py --server --json new.json --compare run.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import database
+from survey import compile_survey
+
+ADMIN = ('bench', 'bench')
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, round(q * (len(sorted_values) - 1)))]
+
+def summarize(name, kind, latencies, elapsed, errors=0):
+    """One result row; latencies in seconds"""
+    values = sorted(latencies)
+    return {'name': name, 'kind': kind, 'count': len(values), 'errors': errors,
+            'seconds': round(elapsed, 4),
+            'throughput': round(len(values) / elapsed, 2) if elapsed else None,
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.5) * 1000, 3),
+            'p90_ms': round(percentile(values, 0.9) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3)}
+
+def populate(path, raw_config, teams, respondents, open_share, rng):
+    """Fill a fresh database with teams x respondents responses through database.insert_response"""
+    conn = database.connect(path)
+    database.migrate(conn)
+    survey = compile_survey(raw_config, conn)
+    started = time.perf_counter()
+    base = datetime(2025, 1, 1)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    for team in range(teams):
+        for i in range(respondents):
+            role = rng.choice(survey.roles)
+            answers = [[text, 'Ответ'] for text in survey.open_fields.values()] if rng.random() < open_share else []
+            database.insert_response(cursor, {
+                'key': f'{rng.getrandbits(128):032x}',
+                'timestamp': (base + timedelta(minutes=team * respondents + i)).strftime('%Y-%m-%d %H:%M:%S'),
+                'role': role, 'respondent_name': f'Respondent {team}-{i}', 'member_amnt': rng.randint(3, 30),
+                'member_cost': rng.randint(1000, 9000), 'team_id': team, 'mail': None,
+                'industry': rng.choice(['it', 'retail', 'finance']), 'company': 'Bench', 'job': 'Bench',
+                'config_version': survey.version,
+                'ratings': [[question.id, question.category, rng.randint(1, 10)]
+                            for question in survey.rating_fields[role].values()],
+                'open_answers': answers})
+    conn.commit()
+    ratings = conn.execute('SELECT COUNT(*) FROM ratings').fetchone()[0]
+    conn.close()
+    print(f'populated {teams * respondents} responses / {ratings} ratings in '
+          f'{time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+def prepare_workdir(workdir, db_path, args):
+    """Directory the app runs in (it reads config/ and admins.json relative to it), and its config module"""
+    shutil.copytree(os.path.join(ROOT, 'config'), os.path.join(workdir, 'config'))
+    with open(os.path.join(workdir, 'admins.json'), 'w') as f:
+        json.dump(dict([ADMIN]), f)
+    # config.py is deployment specific and not part of the repository; without it
+    # this imports the config/ directory as an empty namespace package
+    import config
+    if not hasattr(config, 'SECRET_KEY'):
+        config.SECRET_KEY = 'benchmark'
+        config.URL_START = 'http://localhost'
+    config.DATABASE_PATH = db_path
+    config.WRITE_BEHIND = args.write_behind
+    config.WRITE_SPOOL_DIR = os.path.join(workdir, 'spool')
+    # The limiter guards against single browsers; here every request comes from one address
+    config.SPIDER_RATE_LIMIT = (10 ** 9, 60)
+    os.chdir(workdir)
+
+class TestClientDriver:
+    """Requests through the Flask test client, one client per thread"""
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, form=None, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, data=form, json=body, headers=headers or {})
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+class ServerDriver:
+    """Requests over HTTP to the app served by werkzeug's threaded server on a free port"""
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, method, path, form=None, body=None, headers=None):
+        headers = dict(headers or {})
+        if form is not None:
+            payload = urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        else:
+            payload = None
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+
+def scenarios(main, teams, rng):
+    """name -> function(rng) returning (method, path, form, json, headers) of one request"""
+    survey = main.config_service.survey
+    auth = {'Authorization': 'Basic ' + b64encode(':'.join(ADMIN).encode()).decode()}
+
+    def submit(rng):
+        role = rng.choice(survey.roles)
+        form = {'role': role, 'respondent_name': 'Load test', 'config_version': survey.version}
+        form.update({field: rng.randint(1, 10) for field in survey.rating_fields[role]})
+        return 'POST', f'/submit?t={rng.randrange(teams)}', form, None, None
+
+    def spider(rng):
+        role = rng.choice(survey.roles)
+        ratings = {field: rng.randint(1, 10) for field in survey.rating_fields[role]}
+        return 'POST', '/spider', None, {'role': role, 'ratings': ratings}, None
+
+    def survey_page(rng):
+        headers = {'Accept-Encoding': 'gzip, br'}
+        return 'GET', f'/survey/{rng.choice(survey.roles)}?t={rng.randrange(teams)}', None, None, headers
+
+    return {'survey': survey_page,
+            'submit': submit,
+            'spider': spider,
+            'admin': lambda rng: ('GET', '/admin', None, None, auth),
+            'group': lambda rng: ('GET', f'/group?t={rng.randrange(teams)}', None, None, None),
+            'role': lambda rng: ('GET', f'/role/{rng.choice(survey.roles)}', None, None, None)}
+
+def run_http(driver, name, make_request, requests, concurrency, warmup, seed):
+    """Send requests from concurrency threads; 4xx/5xx count as errors"""
+    for i in range(warmup):
+        driver.request(*make_request(random.Random(seed - i)))
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            method, path, form, body, headers = make_request(rng)
+            started = time.perf_counter()
+            status = driver.request(method, path, form, body, headers)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(name, 'http', latencies, time.perf_counter() - started, len(errors))
+    if errors:
+        result['statuses'] = sorted(set(errors))
+    return result
+
+def run_micro(name, function, repeat, setup=None):
+    latencies = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        if setup:
+            setup(i)
+        t = time.perf_counter()
+        function(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(name, 'micro', latencies, time.perf_counter() - started)
+
+def micro_benchmarks(main, teams, repeat, rng):
+    """Chart rendering and the aggregates behind the dashboards, called directly"""
+    survey = main.config_service.survey
+    categories = list(survey.category_names)
+    values = [[round(rng.uniform(1, 10), 1) for _ in categories] for _ in range(repeat)]
+    conn = main.get_db_connection()
+    snapshot = main.get_snapshot()
+
+    def clear_dashboards(i):
+        # The snapshot memoises category means and response stats too
+        main.dashboard_cache.clear()
+        snapshot._results.clear()
+
+    def clear_snapshot_memo(i):
+        snapshot._results.clear()
+
+    results = [
+        # Distinct values every time, so every call draws
+        run_micro('generate_spider_chart (render)',
+                  lambda i: main.generate_spider_chart(values[i], categories, 'Benchmark'), repeat),
+        run_micro('generate_spider_chart (cached)',
+                  lambda i: main.generate_spider_chart(values[0], categories, 'Benchmark'), repeat),
+        run_micro('dashboard data, all teams', lambda i: main.get_dashboard_data(), repeat, clear_dashboards),
+        run_micro('dashboard data, one team',
+                  lambda i: main.get_dashboard_data(str(i % teams)), repeat, clear_dashboards),
+        run_micro('snapshot question stats, one team',
+                  lambda i: snapshot.question_stats(i % teams), repeat, clear_snapshot_memo),
+        run_micro('sql category_aggregates',
+                  lambda i: conn.execute('''SELECT role, category, SUM(rating_sum), SUM(rating_count)
+                                            FROM category_aggregates GROUP BY role, category''').fetchall(),
+                  repeat),
+        run_micro('sql category averages from ratings',
+                  lambda i: conn.execute('''SELECT q.role, q.category, AVG(rt.rating)
+                                            FROM ratings rt JOIN questions q ON q.id = rt.question_id
+                                            GROUP BY q.role, q.category''').fetchall(),
+                  max(1, repeat // 10)),
+    ]
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous_path, threshold):
+    """Print changes against a previous run; returns the names that got slower than threshold"""
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {row['name']: row for row in json.load(f)['results']}
+    regressions = []
+    print(f"\n{'benchmark':40} {'p50 before':>11} {'p50 now':>9} {'change':>8}")
+    for row in results:
+        before = previous.get(row['name'])
+        if not before:
+            continue
+        change = row['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(row['name'])
+            flag = '  REGRESSION'
+        print(f"{row['name']:40} {before['p50_ms']:>9.2f}ms {row['p50_ms']:>7.2f}ms {change:>+8.0%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--teams', type=int, default=100, help='teams to generate (default: %(default)s)')
+    parser.add_argument('--respondents', type=int, default=20,
+                        help='respondents per team, roles drawn at random (default: %(default)s)')
+    parser.add_argument('--open-share', type=float, default=0.3,
+                        help='share of responses with open answers (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads (default: %(default)s)')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per endpoint (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=50, help='calls per micro-benchmark (default: %(default)s)')
+    parser.add_argument('--endpoints', default='survey,submit,spider,admin,group,role',
+                        help='comma separated subset of %(default)s')
+    parser.add_argument('--server', action='store_true', help='go through a local WSGI server, not the test client')
+    parser.add_argument('--write-behind', action='store_true', help='run with WRITE_BEHIND on')
+    parser.add_argument('--no-micro', action='store_true', help='skip the micro-benchmarks')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='database file to (re)create, defaults to a temp file')
+    parser.add_argument('--json', help='write results here (default: stdout)')
+    parser.add_argument('--compare', help='results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='p50 slowdown reported as a regression, exit status 1 (default: %(default)s)')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    # The app runs in a directory of its own, see prepare_workdir()
+    args.json = args.json and os.path.abspath(args.json)
+    args.compare = args.compare and os.path.abspath(args.compare)
+
+    workdir = tempfile.mkdtemp(prefix='survey-bench-')
+    db_path = os.path.abspath(args.db or os.path.join(workdir, 'survey.db'))
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    with open(os.path.join(ROOT, 'config', 'survey_config.json'), encoding='utf-8') as f:
+        raw_config = json.load(f)
+    populate(db_path, raw_config, args.teams, args.respondents, args.open_share, rng)
+    prepare_workdir(workdir, db_path, args)
+
+    started = time.perf_counter()
+    import main as app_module
+    print(f'app started in {time.perf_counter() - started:.2f}s', file=sys.stderr)
+
+    driver = ServerDriver(app_module.app) if args.server else TestClientDriver(app_module.app)
+    results = []
+    try:
+        endpoints = scenarios(app_module, args.teams, rng)
+        for name in args.endpoints.split(','):
+            result = run_http(driver, name, endpoints[name], args.requests, args.concurrency,
+                              args.warmup, args.seed)
+            results.append(result)
+            print(f"{name:10} {result['throughput']:8.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+                  f"p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}", file=sys.stderr)
+        if not args.no_micro:
+            with app_module.app.test_request_context():
+                for result in micro_benchmarks(app_module, args.teams, args.repeat, rng):
+                    results.append(result)
+                    print(f"{result['name']:40} p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms",
+                          file=sys.stderr)
+    finally:
+        driver.close()
+        if app_module.submission_writer:
+            app_module.submission_writer.close()
+        app_module.chart_pool.shutdown()
+
+    report = {'meta': {'revision': git_revision(), 'started': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'cpus': os.cpu_count(), 'driver': 'server' if args.server else 'test_client',
+                       'teams': args.teams, 'respondents': args.respondents, 'requests': args.requests,
+                       'concurrency': args.concurrency, 'write_behind': args.write_behind, 'seed': args.seed},
+              'results': results}
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    shutil.rmtree(workdir, ignore_errors=True)
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Query plans and timings of the app's hot queries before and after the index migration.
+
+Builds a throwaway database with a few million ratings, runs the queries on the
+schema without secondary indexes, applies the remaining migrations and runs them again.
+
+    python benchmarks/query_plans.py --responses 120000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+
+ROLES = ['Manager', 'Employee']
+CATEGORIES = ['Thrust', 'Trust', 'Talent & Skills', 'Technology & AI', 'Tenets']
+QUESTIONS_PER_CATEGORY = 5
+
+QUERIES = {
+    'ratings of one response': (
+        'SELECT category, question, rating FROM ratings WHERE response_id = ? ORDER BY category',
+        lambda n: (random.randint(1, n),)),
+    'open answers of one response': (
+        'SELECT question, answer FROM open_answers WHERE response_id = ?',
+        lambda n: (random.randint(1, n),)),
+    'next group link (MAX(team_id))': (
+        'SELECT MAX(team_id) FROM responses',
+        lambda n: ()),
+    'dashboard roles of one team': (
+        '''SELECT role, COUNT(*) as response_count, MAX(timestamp) as last_timestamp
+           FROM responses WHERE team_id = ? GROUP BY role''',
+        lambda n: (random.randint(0, n // 20),)),
+    'dashboard roles, all teams': (
+        '''SELECT role, COUNT(*) as response_count, MAX(timestamp) as last_timestamp
+           FROM responses GROUP BY role''',
+        lambda n: ()),
+    'open answers of one team': (
+        '''SELECT COUNT(*) FROM open_answers oa JOIN responses r ON r.id = oa.response_id
+           WHERE r.team_id = ?''',
+        lambda n: (random.randint(0, n // 20),)),
+    'category averages of one role (raw ratings)': (
+        'SELECT category, AVG(rating) FROM ratings WHERE role = ? GROUP BY category',
+        lambda n: (random.choice(ROLES),)),
+    'latest responses': (
+        'SELECT * FROM responses ORDER BY timestamp DESC LIMIT 50',
+        lambda n: ()),
+}
+
+def populate(conn, responses):
+    start = time.time()
+    base = time.mktime((2025, 1, 1, 0, 0, 0, 0, 0, -1))
+    response_rows = []
+    rating_rows = []
+    open_rows = []
+    for response_id in range(1, responses + 1):
+        role = random.choice(ROLES)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(base + response_id * 60))
+        response_rows.append((response_id, timestamp, role, f'User {response_id}', response_id // 20))
+        for category in CATEGORIES:
+            for question in range(QUESTIONS_PER_CATEGORY):
+                rating_rows.append((response_id, role, category, f'{category} question {question}',
+                                    random.randint(1, 10)))
+        if response_id % 3 == 0:
+            open_rows.append((response_id, 'Open question', 'Some answer'))
+        if len(rating_rows) >= 250000:
+            flush(conn, response_rows, rating_rows, open_rows)
+    flush(conn, response_rows, rating_rows, open_rows)
+    conn.commit()
+    print(f'populated {responses} responses / {responses * len(CATEGORIES) * QUESTIONS_PER_CATEGORY} '
+          f'ratings in {time.time() - start:.1f}s')
+
+def flush(conn, response_rows, rating_rows, open_rows):
+    conn.executemany('INSERT INTO responses (id, timestamp, role, respondent_name, team_id) VALUES (?, ?, ?, ?, ?)',
+                     response_rows)
+    conn.executemany('INSERT INTO ratings (response_id, role, category, question, rating) VALUES (?, ?, ?, ?, ?)',
+                     rating_rows)
+    conn.executemany('INSERT INTO open_answers (response_id, question, answer) VALUES (?, ?, ?)', open_rows)
+    response_rows.clear()
+    rating_rows.clear()
+    open_rows.clear()
+
+def measure(conn, responses, repeat):
+    results = {}
+    for name, (query, make_params) in QUERIES.items():
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', make_params(responses))]
+        timings = []
+        for _ in range(repeat):
+            params = make_params(responses)
+            start = time.perf_counter()
+            conn.execute(query, params).fetchall()
+            timings.append(time.perf_counter() - start)
+        results[name] = (plan, statistics.median(timings))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--responses', type=int, default=120000,
+                        help='responses to generate, 25 ratings each (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query (default: %(default)s)')
+    parser.add_argument('--db', help='database file to (re)create, defaults to a temp file')
+    args = parser.parse_args()
+    random.seed(42)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    index_version = database.MIGRATIONS.index(database.create_indexes) + 1
+    database.migrate(conn, target=index_version - 1)
+    populate(conn, args.responses)
+
+    before = measure(conn, args.responses, args.repeat)
+    start = time.time()
+    # Later migrations change the ratings table these queries were written against
+    database.migrate(conn, target=index_version)
+    print(f'index migration took {time.time() - start:.1f}s')
+    after = measure(conn, args.responses, args.repeat)
+
+    for name in QUERIES:
+        (plan_before, time_before), (plan_after, time_after) = before[name], after[name]
+        print(f'\n{name}: {time_before * 1000:.2f} ms -> {time_after * 1000:.2f} ms '
+              f'({time_before / max(time_after, 1e-9):.0f}x)')
+        print('  before: ' + '; '.join(plan_before))
+        print('  after:  ' + '; '.join(plan_after))
+    conn.close()
+
+if __name__ == '__main__':
+    main()
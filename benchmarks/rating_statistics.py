@@ -0,0 +1,110 @@
+"""Per-question distributions of every team: vectorized NumPy against per-team SQL + Python.
+
+Builds a throwaway database with the same synthetic data as query_plans.py, loads
+it into an analytics.SurveySnapshot and computes mean, std, median and percentiles of
+every question for every team, plus category gaps and team vs company deltas.
+The baseline fetches each team's ratings and uses the statistics module.
+
+    python benchmarks/rating_statistics.py --responses 120000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analytics
+import database
+from query_plans import populate
+
+def python_team_stats(conn, team_id):
+    """The row-by-row way: one query per team, statistics per question in Python"""
+    ratings = {}
+    for row in conn.execute('''SELECT q.role, q.category, q.question, rt.rating
+                               FROM responses r JOIN ratings rt ON rt.response_id = r.id
+                               JOIN questions q ON q.id = rt.question_id
+                               WHERE r.team_id = ?''', (team_id,)):
+        ratings.setdefault((row[0], row[1], row[2]), []).append(row[3])
+    result = {}
+    for question, values in ratings.items():
+        quantiles = statistics.quantiles(values, n=20, method='inclusive') if len(values) > 1 else values * 19
+        result[question] = (len(values), statistics.fmean(values), statistics.pstdev(values),
+                            quantiles[1], quantiles[4], statistics.median(values), quantiles[14], quantiles[17])
+    return result
+
+def team_question_stats(columns):
+    """Distributions of every question for every team in one pass over the snapshot's arrays.
+
+    Returns the team ids and a summarize() dict of (teams, questions) arrays.
+    """
+    n_questions = len(columns.questions)
+    groups = columns.rating_team.values.astype(np.int64) * n_questions + columns.rating_question.values
+    counts = analytics.histograms(groups, columns.rating.values, len(columns.teams) * n_questions)
+    return np.array(columns.teams), {key: values.reshape(len(columns.teams), n_questions)
+                                     for key, values in analytics.summarize(counts).items()}
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--responses', type=int, default=120000,
+                        help='responses to generate, 25 ratings each, 20 per team (default: %(default)s)')
+    parser.add_argument('--sample', type=int, default=50,
+                        help='teams the Python baseline is timed on (default: %(default)s)')
+    parser.add_argument('--db', help='database file to (re)create, defaults to a temp file')
+    args = parser.parse_args()
+    random.seed(42)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    if os.path.exists(path):
+        os.remove(path)
+    conn = database.connect(path)
+    database.migrate(conn, target=1)
+    populate(conn, args.responses)
+    database.migrate(conn)
+
+    columns = analytics.SurveySnapshot({'roles': {}, 'categories': {}})
+    _, load_time = timed(columns.refresh, conn)
+    arrays = [value for value in vars(columns).values() if isinstance(value, (np.ndarray, analytics.GrowableArray))]
+    size = sum(array.nbytes if isinstance(array, np.ndarray) else array.values.nbytes for array in arrays)
+    print(f'loaded {len(columns)} ratings in {load_time:.2f}s ({size / 2**20:.0f} MB, '
+          f'{size / len(columns):.1f} bytes per rating)')
+
+    _, role_time = timed(columns.question_stats, None, columns.roles[0])
+    print(f'question distributions of one role, company-wide: {role_time * 1000:.0f} ms (cached afterwards)')
+
+    (teams, summary), all_time = timed(team_question_stats, columns)
+    print(f'question distributions of all {len(teams)} teams: {all_time * 1000:.0f} ms')
+
+    sample = [int(team) for team in random.sample(list(teams), min(args.sample, len(teams)))]
+    _, one_time = timed(lambda: [columns.question_stats(team) for team in sample])
+    _, gap_time = timed(lambda: [(columns.role_gap(*columns.roles[:2], team_id=team), columns.team_deltas(team)) for team in sample])
+    baseline, python_time = timed(lambda: {team: python_team_stats(conn, team) for team in sample})
+    per_team = python_time / len(sample)
+    print(f'one team, NumPy question stats: {one_time / len(sample) * 1000:.1f} ms, '
+          f'gap + deltas: {gap_time / len(sample) * 1000:.1f} ms')
+    print(f'one team, SQL + Python:         {per_team * 1000:.1f} ms '
+          f'(all teams would take ~{per_team * len(teams):.0f}s, {per_team * len(teams) / all_time:.0f}x)')
+
+    # Same numbers both ways
+    team = sample[0]
+    row = list(teams).index(team)
+    assert summary['count'][row].sum() == sum(values[0] for values in baseline[team].values())
+    for code, question in enumerate(columns.questions):
+        if summary['count'][row, code]:
+            expected = baseline[team][question]
+            got = [summary[key][row, code] for key in ('count', 'mean', 'std', 'p10', 'p25', 'p50', 'p75', 'p90')]
+            assert np.allclose(got, expected), (question, got, expected)
+    print('results match the statistics module')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Cold start of a worker: importing the app, creating it and its first requests.
+
+Every run is a fresh interpreter against a synthetic survey.db (see
+load_test.py), so nothing is warm but the OS page cache. Reported per step:
+import main, create_app(), the first /, /survey/<role>, /admin and
+/chart/overall, which of the heavy modules each step has loaded, and the whole
+process from interpreter start to exit.
+
+    python benchmarks/startup.py --runs 10 --json startup.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from base64 import b64encode
+
+from load_test import ADMIN, ROOT, populate, prepare_workdir, summarize
+
+HEAVY_MODULES = ('numpy', 'matplotlib', 'PIL', 'analytics', 'spider_chart')
+
+def child(args):
+    """One cold start; prints the step timings as JSON"""
+    prepare_workdir(args.workdir, args.db, args)
+    steps = {}
+    started = time.perf_counter()
+
+    def step(name, function):
+        nonlocal started
+        function()
+        now = time.perf_counter()
+        steps[name] = {'seconds': now - started, 'loaded': [m for m in HEAVY_MODULES if m in sys.modules]}
+        started = now
+
+    import main as app_module
+    step('import', lambda: None)
+    app = app_module.create_app()
+    step('create_app', lambda: None)
+    client = app.test_client()
+    auth = {'Authorization': 'Basic ' + b64encode(':'.join(ADMIN).encode()).decode()}
+    role = app_module.config_service.survey.roles[0]
+    for name, url, headers in (('/', '/', {}), ('/survey', f'/survey/{role}', {}),
+                               ('/admin', '/admin', auth), ('/chart', '/chart/overall', {})):
+        def get():
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200, (url, response.status_code)
+        step(name, get)
+    app_module.chart_pool.shutdown()
+    print(json.dumps(steps))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='cold starts to measure (default: %(default)s)')
+    parser.add_argument('--teams', type=int, default=100, help='teams to generate (default: %(default)s)')
+    parser.add_argument('--respondents', type=int, default=20, help='respondents per team (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help='write results here (default: stdout)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # prepare_workdir() reads these from the load test's arguments
+    args.write_behind = False
+    if args.child:
+        return child(args)
+
+    base = tempfile.mkdtemp(prefix='survey-startup-')
+    db_path = os.path.join(base, 'survey.db')
+    with open(os.path.join(ROOT, 'config', 'survey_config.json'), encoding='utf-8') as f:
+        raw_config = json.load(f)
+    populate(db_path, raw_config, args.teams, args.respondents, 0.3, random.Random(args.seed))
+
+    runs = []
+    for i in range(args.runs):
+        # prepare_workdir() copies the config into a directory that must not exist yet
+        workdir = os.path.join(base, f'run{i}')
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--workdir', workdir,
+                                 '--db', db_path], capture_output=True, text=True, check=True).stdout
+        steps = json.loads(output.splitlines()[-1])
+        # Interpreter start to exit, all of the above included
+        steps['process'] = {'seconds': time.perf_counter() - started, 'loaded': steps['/chart']['loaded']}
+        runs.append(steps)
+
+    results = []
+    for name in runs[0]:
+        result = summarize(name, 'startup', [run[name]['seconds'] for run in runs],
+                           sum(run[name]['seconds'] for run in runs))
+        result.pop('throughput')
+        result['loaded'] = runs[0][name]['loaded']
+        results.append(result)
+        print(f"{name:12} p50 {result['p50_ms']:8.1f} ms  p90 {result['p90_ms']:8.1f} ms  "
+              f"loaded: {', '.join(result['loaded']) or '-'}", file=sys.stderr)
+
+    report = json.dumps({'runs': args.runs, 'results': results}, indent=2, ensure_ascii=False)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    main()
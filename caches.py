@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """Bounded, thread-safe LRU of any values (None means a miss), with hit/miss stats"""
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'size': len(self._entries),
+                    'max_entries': self.max_entries}
+
+class DiskCache(LRUCache):
+    """LRUCache of bytes, optionally mirrored to one file per key in directory.
+
+    Keys become file names. Entries evicted from memory are read back from
+    disk, so the directory outlives restarts and is shared by every worker
+    pointed at it; clear() only forgets the in-memory copies.
+    """
+    def __init__(self, max_entries=256, directory=None):
+        super().__init__(max_entries)
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.directory and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            super().put(key, data)
+            with self._lock:
+                self.hits += 1
+            return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data):
+        super().put(key, data)
+        if self.directory:
+            # Write to a temp file first so readers never see half a file; mkstemp names
+            # are unique across forked workers, whose main threads share an ident
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
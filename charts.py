@@ -0,0 +1,118 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from caches import DiskCache
+
+TITLE_FORMAT = "{0}\nИндекс максимума команды - {1}/10"
+CATEG_FORMAT = "{0} ({1}/10)"
+
+CHART_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Part of every cache key (and so every ETag); bump when the drawing changes
+RENDERER_VERSION = 2
+
+# zlib level for PNG output; charts are cached, so favour encode speed over a few KB
+PNG_COMPRESS_LEVEL = 1
+# Charts only use a handful of colours plus their anti-aliasing blends
+PNG_PALETTE_COLORS = 64
+
+class ChartCache(DiskCache):
+    """Bounded LRU cache of rendered chart images, optionally mirrored to disk"""
+    @staticmethod
+    def make_key(values, categories, title, labels, fmt='png'):
+        """Content hash of everything that ends up in the picture, plus the format"""
+        payload = json.dumps([RENDERER_VERSION, values, categories, title, labels], ensure_ascii=False)
+        return f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()}.{fmt}"
+
+def render_spider_chart(values, labels, title, fmt='png'):
+    """Render a spider/radar chart to PNG or SVG bytes; labels are the category display names"""
+    if fmt not in CHART_MIMETYPES:
+        raise ValueError(f"Unsupported chart format: {fmt}")
+    # matplotlib, NumPy and PIL are loaded with the first chart, not with the app
+    from spider_chart import get_template
+    return get_template(len(labels)).render(values, labels, title, fmt)
+
+class ChartRenderPool:
+    """Renders charts in worker processes and stores them in a ChartCache.
+
+    Each worker has its own templates, so charts are drawn in parallel across
+    cores instead of queueing on one figure. A render that is already in flight
+    is shared by everyone asking for the same key. With workers=0 charts are
+    rendered in the calling thread.
+    """
+    def __init__(self, cache, workers=None, on_render=None):
+        self.cache = cache
+        # Called with (format, seconds) after each chart drawn for a cache miss
+        self.on_render = on_render
+        if workers is None:
+            # A single core gains nothing from a pool but pays for the IPC
+            cpus = os.cpu_count() or 1
+            workers = min(4, cpus) if cpus > 1 else 0
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Forked app workers need their own pool; spawn keeps children free of app state
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self._pid = os.getpid()
+            self._pending = {}
+        return self._executor
+
+    def submit(self, key, values, labels, title, fmt='png'):
+        """Future resolving to the image bytes of the chart identified by key"""
+        image = self.cache.get(key)
+        if image is not None:
+            future = Future()
+            future.set_result(image)
+            return future
+        started = time.perf_counter()
+        if not self.workers:
+            future = Future()
+            future.set_result(self._store(key, render_spider_chart(values, labels, title, fmt)))
+            self._rendered(fmt, started)
+            return future
+        with self._lock:
+            executor = self._get_executor()
+            if key in self._pending:
+                return self._pending[key]
+            try:
+                future = executor.submit(render_spider_chart, values, labels, title, fmt)
+            except BrokenProcessPool:
+                self._executor = None
+                future = self._get_executor().submit(render_spider_chart, values, labels, title, fmt)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._finish(key, done, fmt, started))
+        return future
+
+    def _rendered(self, fmt, started):
+        if self.on_render:
+            self.on_render(fmt, time.perf_counter() - started)
+
+    def _finish(self, key, future, fmt, started):
+        with self._lock:
+            self._pending.pop(key, None)
+            if isinstance(future.exception(), BrokenProcessPool):
+                # A worker died; the next submit starts a fresh pool
+                self._executor = None
+        if not future.cancelled() and future.exception() is None:
+            self._store(key, future.result())
+            self._rendered(fmt, started)
+
+    def _store(self, key, image):
+        self.cache.put(key, image)
+        return image
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
@@ -0,0 +1,65 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.security import check_password_hash
+
+# Prefixes of werkzeug.security hashes; any other value in admins.json is a plain password
+HASH_METHODS = ('pbkdf2:', 'scrypt:')
+
+class AdminUsers:
+    """Admin logins from admins.json, checked without paying for the KDF on every request.
+
+    Values may be werkzeug password hashes (see `flask hash-password`) or plain
+    passwords. A hash is checked with its KDF once; the credentials are then
+    remembered for ttl seconds as an HMAC under a key that never leaves the
+    process, so a dashboard and the charts it pulls in don't each run the KDF.
+    Failed attempts are never remembered, and the stored hash is part of the
+    HMAC, so a changed password doesn't match old entries.
+
+    Plain passwords are compared as HMACs as well. Hashing them at load time
+    (as was done before) cost a KDF run per admin at every start and protected
+    nothing while admins.json holds them in the clear.
+    """
+    def __init__(self, passwords, ttl=300, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._hashes = {}
+        self._plain = {}
+        for username, password in passwords.items():
+            if password.startswith(HASH_METHODS):
+                self._hashes[username] = password
+            else:
+                self._plain[username] = self._digest(username, password)
+        # digest of verified credentials -> monotonic expiry time
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, *parts):
+        return hmac.new(self._key, '\0'.join(parts).encode('utf-8'), hashlib.sha256).digest()
+
+    def verify(self, username, password):
+        """True if the password is the user's"""
+        if username in self._plain:
+            return hmac.compare_digest(self._plain[username], self._digest(username, password))
+        stored = self._hashes.get(username)
+        if stored is None:
+            return False
+        digest = self._digest(username, password, stored)
+        now = time.monotonic()
+        with self._lock:
+            expires = self._verified.get(digest)
+            if expires is not None and expires > now:
+                return True
+        if not check_password_hash(stored, password):
+            return False
+        with self._lock:
+            self._verified[digest] = now + self.ttl
+            self._verified.move_to_end(digest)
+            while len(self._verified) > self.max_entries:
+                self._verified.popitem(last=False)
+        return True
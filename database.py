@@ -0,0 +1,421 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from flask import g, has_app_context
+
+import metrics
+
+DB_PATH = 'survey.db'
+
+# Applied to every connection; WAL lets readers and the single writer proceed concurrently
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # durable across app crashes, fsyncs only at checkpoints
+    'cache_size': -16000,  # KiB, i.e. 16 MB of page cache per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # ms to wait for the write lock instead of failing at once
+}
+
+# Team id stored in category_aggregates for responses submitted without ?t=
+NO_TEAM = -1
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that adds its statement and fetch time to the current request's metrics.
+
+    Iterating over a cursor isn't timed; that time counts towards whatever the loop does.
+    """
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_query(time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.record_query(time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.record_query(time.perf_counter() - started, 0)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.record_query(time.perf_counter() - started, 0)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.record_query(time.perf_counter() - started, 0)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the ones execute() makes, are TimedCursors"""
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+def connect(path=None):
+    """Open a tuned connection; the caller owns it and must close it"""
+    conn = sqlite3.connect(path or DB_PATH, timeout=PRAGMAS['busy_timeout'] / 1000,
+                           check_same_thread=False, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+class ConnectionPool:
+    """Keeps idle connections around so requests don't reconnect and re-tune every time"""
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: connections inherited from the parent must not be used
+                self._idle = queue.LifoQueue()
+                self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._pid != os.getpid() or self._idle.qsize() >= self.max_idle:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+pool = ConnectionPool()
+
+def get_db_connection():
+    """Connection for the current app context, returned to the pool on teardown.
+
+    Outside an app context a fresh connection is returned and the caller must close it.
+    """
+    if not has_app_context():
+        return connect()
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+def release_db_connection(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+def init_app(app, path=None, pragmas=None, max_idle=None):
+    """Point the module at the app's database and hook connection release into teardown"""
+    global DB_PATH
+    if path:
+        DB_PATH = path
+    if pragmas:
+        PRAGMAS.update(pragmas)
+    if max_idle is not None:
+        pool.max_idle = max_idle
+    app.teardown_appcontext(release_db_connection)
+
+# Migrations are applied in list order; a migration's version is its position + 1.
+# Never edit or reorder a released migration, append a new one instead.
+def create_base_tables(conn):
+    """Responses, ratings and open answers (the original schema)"""
+    # Create main responses table
+    conn.execute('''CREATE TABLE IF NOT EXISTS responses
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  timestamp TEXT,
+                  role TEXT,
+                  respondent_name TEXT,
+                  member_cost REAL,
+                  member_amnt INTEGER,
+                  team_id INTEGER,
+                  mail TEXT,
+                  industry TEXT,
+                  company TEXT,
+                  job TEXT)''')
+
+    # Create table for rating questions
+    conn.execute('''CREATE TABLE IF NOT EXISTS ratings
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  response_id INTEGER,
+                  role TEXT,
+                  category TEXT,
+                  question TEXT,
+                  rating INTEGER,
+                  FOREIGN KEY (response_id) REFERENCES responses (id))''')
+
+    # Create table for open questions
+    conn.execute('''CREATE TABLE IF NOT EXISTS open_answers
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  response_id INTEGER,
+                  question TEXT,
+                  answer TEXT,
+                  FOREIGN KEY (response_id) REFERENCES responses (id))''')
+
+def create_category_aggregates(conn):
+    """Running totals per (team, role, category) so dashboards don't scan ratings"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS category_aggregates
+                 (team_id INTEGER NOT NULL,
+                  role TEXT NOT NULL,
+                  category TEXT NOT NULL,
+                  rating_sum INTEGER NOT NULL DEFAULT 0,
+                  rating_count INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (team_id, role, category))''')
+    # Written out rather than calling rebuild_aggregates(): ratings still has its text columns here
+    conn.execute('''INSERT INTO category_aggregates (team_id, role, category, rating_sum, rating_count)
+                    SELECT COALESCE(r.team_id, ?), rt.role, rt.category, SUM(rt.rating), COUNT(rt.rating)
+                    FROM ratings rt
+                    LEFT JOIN responses r ON rt.response_id = r.id
+                    GROUP BY 1, 2, 3''', (NO_TEAM,))
+
+def create_indexes(conn):
+    """Secondary indexes for every lookup the app does by response, role, team or time"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_response ON ratings (response_id)')
+    # Covers per-role/category averages without touching the table rows
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_role_category ON ratings (role, category, rating)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_open_answers_response ON open_answers (response_id)')
+    # Team pages, MAX(team_id) for new group links and per-role MAX(timestamp)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_team ON responses (team_id, role, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_role ON responses (role, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_timestamp ON responses (timestamp)')
+    conn.execute('ANALYZE')
+
+def add_response_counters(conn):
+    """Per-response rating/open answer counts, so listings don't join and count"""
+    conn.execute('ALTER TABLE responses ADD COLUMN rating_count INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE responses ADD COLUMN open_count INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''UPDATE responses SET
+                    rating_count = (SELECT COUNT(*) FROM ratings WHERE response_id = responses.id),
+                    open_count = (SELECT COUNT(*) FROM open_answers WHERE response_id = responses.id)''')
+    # Keyset pagination walks (timestamp, id) newest first within each filter
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_team_timestamp ON responses (team_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_industry ON responses (industry, timestamp)')
+
+def normalize_ratings(conn):
+    """Questions dimension table; ratings keep a question_id instead of role, category and text"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS questions
+                 (id INTEGER PRIMARY KEY,
+                  role TEXT NOT NULL,
+                  category TEXT NOT NULL,
+                  question TEXT NOT NULL,
+                  UNIQUE (role, category, question))''')
+    conn.execute('''INSERT OR IGNORE INTO questions (role, category, question)
+                    SELECT COALESCE(role, ''), COALESCE(category, ''), COALESCE(question, '')
+                    FROM ratings GROUP BY 1, 2, 3 ORDER BY MIN(id)''')
+    conn.execute('''CREATE TABLE ratings_normalized
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  response_id INTEGER,
+                  question_id INTEGER,
+                  rating INTEGER,
+                  FOREIGN KEY (response_id) REFERENCES responses (id),
+                  FOREIGN KEY (question_id) REFERENCES questions (id))''')
+    conn.execute('''INSERT INTO ratings_normalized (id, response_id, question_id, rating)
+                    SELECT rt.id, rt.response_id, q.id, rt.rating
+                    FROM ratings rt JOIN questions q
+                    ON q.role = COALESCE(rt.role, '') AND q.category = COALESCE(rt.category, '')
+                    AND q.question = COALESCE(rt.question, '')
+                    ORDER BY rt.id''')
+    conn.execute('DROP TABLE ratings')
+    conn.execute('ALTER TABLE ratings_normalized RENAME TO ratings')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_response ON ratings (response_id)')
+    # Covers per-question (and, through questions, per-category) group-bys
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_question ON ratings (question_id, rating)')
+    conn.execute('ANALYZE')
+
+def add_config_versions(conn):
+    """Every survey config the app has served; responses record the one they were filled in"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS config_versions
+                 (id INTEGER PRIMARY KEY,
+                  digest TEXT NOT NULL UNIQUE,
+                  config TEXT NOT NULL,
+                  created_at TEXT)''')
+    # NULL for responses submitted before configs were versioned
+    conn.execute('ALTER TABLE responses ADD COLUMN config_version INTEGER REFERENCES config_versions (id)')
+
+def add_submission_keys(conn):
+    """Unique key per submitted form, so a queued submission is never inserted twice"""
+    conn.execute('ALTER TABLE responses ADD COLUMN submission_key TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_submission_key ON responses (submission_key)')
+
+MIGRATIONS = [
+    create_base_tables,
+    create_category_aggregates,
+    create_indexes,
+    add_response_counters,
+    normalize_ratings,
+    add_config_versions,
+    add_submission_keys,
+]
+
+def get_schema_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                 (version INTEGER PRIMARY KEY,
+                  name TEXT,
+                  applied_at TEXT)''')
+    return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to target (default: all), one transaction each"""
+    target = len(MIGRATIONS) if target is None else target
+    # Every start but the first after a deploy finds the schema current; a read settles that
+    try:
+        version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+        if version >= target:
+            return version
+    except sqlite3.OperationalError:
+        pass  # no schema_version table yet
+    while True:
+        # IMMEDIATE takes the write lock up front, so workers starting together
+        # can't both apply the same migration
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = get_schema_version(conn)
+            if version >= target:
+                conn.commit()
+                return version
+            migration = MIGRATIONS[version]
+            migration(conn)
+            conn.execute('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                         (version + 1, migration.__name__, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+# Database setup
+def init_db():
+    conn = connect()
+    migrate(conn)
+    conn.close()
+
+def response_filter_clauses(filters, prefix=''):
+    """WHERE clauses and parameters for response listing filters (role, t, industry, from, to).
+
+    prefix qualifies the responses columns, e.g. 'r.' when joined with ratings.
+    """
+    clauses = []
+    params = []
+    for key, column in (('role', 'role'), ('t', 'team_id'), ('industry', 'industry')):
+        if key in filters:
+            clauses.append(f'{prefix}{column} = ?')
+            params.append(filters[key])
+    if 'from' in filters:
+        clauses.append(f'{prefix}timestamp >= ?')
+        params.append(filters['from'])
+    if 'to' in filters:
+        # Dates are inclusive; timestamps are 'YYYY-MM-DD HH:MM:SS'
+        clauses.append(f'{prefix}timestamp <= ?')
+        params.append(f"{filters['to']} 23:59:59")
+    return clauses, params
+
+def rebuild_aggregates(conn):
+    """Recompute category_aggregates from the ratings table"""
+    conn.execute('DELETE FROM category_aggregates')
+    conn.execute('''INSERT INTO category_aggregates (team_id, role, category, rating_sum, rating_count)
+                    SELECT COALESCE(r.team_id, ?), q.role, q.category, SUM(rt.rating), COUNT(rt.rating)
+                    FROM ratings rt
+                    JOIN questions q ON q.id = rt.question_id
+                    LEFT JOIN responses r ON rt.response_id = r.id
+                    GROUP BY 1, 2, 3''', (NO_TEAM,))
+
+def sync_questions(conn, questions):
+    """Ids of (role, category, question) triples, adding the ones the table doesn't have yet"""
+    def known_ids():
+        return {(row['role'], row['category'], row['question']): row['id']
+                for row in conn.execute('SELECT id, role, category, question FROM questions')}
+    ids = known_ids()
+    missing = [question for question in questions if question not in ids]
+    # Only take the write lock when the config has questions the table hasn't seen
+    if missing:
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO questions (role, category, question) VALUES (?, ?, ?)',
+                             missing)
+        ids = known_ids()
+    return [ids[question] for question in questions]
+
+def register_config_version(conn, digest, config_json):
+    """Id of a survey config in config_versions, adding it if it's new"""
+    row = conn.execute('SELECT id FROM config_versions WHERE digest = ?', (digest,)).fetchone()
+    if row:
+        return row[0]
+    with conn:
+        conn.execute('INSERT OR IGNORE INTO config_versions (digest, config, created_at) VALUES (?, ?, ?)',
+                     (digest, config_json, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return conn.execute('SELECT id FROM config_versions WHERE digest = ?', (digest,)).fetchone()[0]
+
+def get_config_version(conn, version):
+    """Stored JSON text of a config version, or None"""
+    row = conn.execute('SELECT config FROM config_versions WHERE id = ?', (version,)).fetchone()
+    return row[0] if row else None
+
+def insert_response(cursor, submission):
+    """Insert a submission with its ratings and open answers and add it to the aggregates.
+
+    submission is a dict as built by submit(): response fields plus
+    'ratings' as [question_id, category, rating] and 'open_answers' as
+    [question, answer] lists. Returns the response id; a submission whose key
+    is already stored isn't inserted again.
+    """
+    cursor.execute('''INSERT OR IGNORE INTO responses
+                      (timestamp, role, respondent_name, member_amnt, member_cost, team_id, mail, industry,
+                       company, job, rating_count, open_count, config_version, submission_key)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                   (submission['timestamp'], submission['role'], submission['respondent_name'],
+                    submission['member_amnt'], submission['member_cost'], submission['team_id'],
+                    submission['mail'], submission['industry'], submission['company'], submission['job'],
+                    len(submission['ratings']), len(submission['open_answers']),
+                    submission['config_version'], submission['key']))
+    if not cursor.rowcount:
+        return cursor.execute('SELECT id FROM responses WHERE submission_key = ?',
+                              (submission['key'],)).fetchone()[0]
+    response_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO ratings (response_id, question_id, rating) VALUES (?, ?, ?)',
+                       [(response_id, question_id, rating) for question_id, _, rating in submission['ratings']])
+    cursor.executemany('INSERT INTO open_answers (response_id, question, answer) VALUES (?, ?, ?)',
+                       [(response_id, question, answer) for question, answer in submission['open_answers']])
+    totals = {}
+    for _, category, rating in submission['ratings']:
+        rating_sum, rating_count = totals.get(category, (0, 0))
+        totals[category] = (rating_sum + rating, rating_count + 1)
+    update_aggregates(cursor, submission['team_id'], submission['role'], totals)
+    return response_id
+
+def update_aggregates(cursor, team_id, role, totals):
+    """Add one response's per-category (sum, count) totals to category_aggregates"""
+    cursor.executemany('''INSERT INTO category_aggregates (team_id, role, category, rating_sum, rating_count)
+                          VALUES (?, ?, ?, ?, ?)
+                          ON CONFLICT (team_id, role, category) DO UPDATE SET
+                          rating_sum = rating_sum + excluded.rating_sum,
+                          rating_count = rating_count + excluded.rating_count''',
+                       [(NO_TEAM if team_id is None else team_id, role, category, rating_sum, rating_count)
+                        for category, (rating_sum, rating_count) in totals.items()])
@@ -0,0 +1,236 @@
+import csv
+import io
+import json
+from itertools import groupby
+
+import database
+
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8',
+                  'jsonl': 'application/x-ndjson',
+                  'parquet': 'application/vnd.apache.parquet'}
+
+RESPONSE_COLUMNS = ['id', 'timestamp', 'role', 'respondent_name', 'member_cost', 'member_amnt',
+                    'team_id', 'mail', 'industry', 'company', 'job', 'config_version']
+
+# Rows per fetchmany() call and records per yielded chunk of output
+CHUNK_SIZE = 1000
+
+def fetch_rows(cursor, chunk_size=CHUNK_SIZE):
+    """Rows of a cursor, read chunk_size at a time"""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+class ResponseGroups:
+    """Rows of a cursor ordered by response_id, handed out one response at a time"""
+    def __init__(self, rows):
+        self._groups = groupby(rows, key=lambda row: row['response_id'])
+        self._advance()
+
+    def _advance(self):
+        self._response_id, self._rows = next(self._groups, (None, ()))
+
+    def take(self, response_id):
+        while self._response_id is not None and self._response_id < response_id:
+            self._advance()
+        if self._response_id != response_id:
+            return []
+        rows = list(self._rows)
+        self._advance()
+        return rows
+
+def iter_responses(conn, filters, chunk_size=CHUNK_SIZE):
+    """Yield (response, ratings, open answers) for every matching response, in id order.
+
+    Responses, ratings and open answers are read by three cursors walking the
+    same id order and merged on the fly, so memory doesn't grow with the table.
+    Everything is read inside one transaction, i.e. from a single snapshot; in
+    WAL mode that doesn't block writers.
+
+    The outer loop is pinned to a rowid scan of responses (NOT INDEXED, CROSS
+    JOIN): with a team or date index the planner would otherwise sort the
+    joined rows in a temp B-tree as big as the export.
+    """
+    clauses, params = database.response_filter_clauses(filters, 'r.')
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    conn.execute('BEGIN')
+    try:
+        responses = conn.execute(f'''SELECT {', '.join(f'r.{c}' for c in RESPONSE_COLUMNS)}
+                                     FROM responses r NOT INDEXED {where}
+                                     ORDER BY r.id''', params)
+        ratings = conn.execute(f'''SELECT rt.response_id, q.category, q.question, rt.rating
+                                   FROM responses r NOT INDEXED
+                                   CROSS JOIN ratings rt ON rt.response_id = r.id
+                                   JOIN questions q ON q.id = rt.question_id {where}
+                                   ORDER BY r.id, rt.id''', params)
+        open_answers = conn.execute(f'''SELECT oa.response_id, oa.question, oa.answer
+                                        FROM responses r NOT INDEXED
+                                        CROSS JOIN open_answers oa ON oa.response_id = r.id {where}
+                                        ORDER BY r.id, oa.id''', params)
+        rating_groups = ResponseGroups(fetch_rows(ratings, chunk_size))
+        open_groups = ResponseGroups(fetch_rows(open_answers, chunk_size))
+        for response in fetch_rows(responses, chunk_size):
+            yield response, rating_groups.take(response['id']), open_groups.take(response['id'])
+    finally:
+        conn.rollback()
+
+def export_columns(survey_config, role=None):
+    """Pivoted column names: response fields, one per rating question, one per open question.
+
+    Questions come from the survey config (only the given role's, if any);
+    ratings for questions no longer in the config are left out of flat formats.
+    ValueError if role isn't one of the config's roles.
+    """
+    roles = [r for r in survey_config['roles'] if r in survey_config]
+    if role:
+        if role not in roles:
+            raise ValueError(f"Unknown role: {role}")
+        roles = [role]
+    rating_columns = {}
+    for r in roles:
+        for category, questions in survey_config.get(r, {}).items():
+            for question in questions:
+                rating_columns.setdefault((category, question), f"{category}: {question}")
+    open_columns = {question: question for question in survey_config['open_questions']}
+    return rating_columns, open_columns
+
+def flat_records(records, rating_columns, open_columns):
+    """One dict per response with ratings and open answers pivoted into columns"""
+    for response, ratings, open_answers in records:
+        record = dict.fromkeys([*RESPONSE_COLUMNS, *rating_columns.values(), *open_columns.values()])
+        record.update({column: response[column] for column in RESPONSE_COLUMNS})
+        for row in ratings:
+            column = rating_columns.get((row['category'], row['question']))
+            if column:
+                record[column] = row['rating']
+        for row in open_answers:
+            column = open_columns.get(row['question'])
+            if column:
+                record[column] = row['answer']
+        yield record
+
+def write_csv(records, rating_columns, open_columns, chunk_size=CHUNK_SIZE):
+    """CSV text in chunks of chunk_size rows"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, [*RESPONSE_COLUMNS, *rating_columns.values(), *open_columns.values()])
+    writer.writeheader()
+    for i, record in enumerate(flat_records(records, rating_columns, open_columns), 1):
+        writer.writerow(record)
+        if i % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def write_jsonl(records, chunk_size=CHUNK_SIZE):
+    """One JSON object per response, ratings nested as {category: {question: rating}}"""
+    lines = []
+    for response, ratings, open_answers in records:
+        record = {column: response[column] for column in RESPONSE_COLUMNS}
+        record['ratings'] = {}
+        for row in ratings:
+            record['ratings'].setdefault(row['category'], {})[row['question']] = row['rating']
+        record['open_answers'] = {row['question']: row['answer'] for row in open_answers}
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) == chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to a generator"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def require_pyarrow():
+    """pyarrow and pyarrow.parquet; RuntimeError if pyarrow isn't installed"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Parquet export needs pyarrow (pip install pyarrow)')
+    return pa, pq
+
+def _number(value, cast):
+    """Form fields are stored as typed, so member_cost may be '' or text"""
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+def write_parquet(records, rating_columns, open_columns, chunk_size=CHUNK_SIZE):
+    """Parquet bytes, one row group per chunk_size responses; needs pyarrow"""
+    pa, pq = require_pyarrow()
+    schema = pa.schema([('id', pa.int64()), ('timestamp', pa.string()), ('role', pa.string()),
+                        ('respondent_name', pa.string()), ('member_cost', pa.float64()),
+                        ('member_amnt', pa.int64()), ('team_id', pa.int64()), ('mail', pa.string()),
+                        ('industry', pa.string()), ('company', pa.string()), ('job', pa.string()),
+                        ('config_version', pa.int64())]
+                       + [(column, pa.int8()) for column in rating_columns.values()]
+                       + [(column, pa.string()) for column in open_columns.values()])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        batch = []
+        for record in flat_records(records, rating_columns, open_columns):
+            record['member_cost'] = _number(record['member_cost'], float)
+            record['member_amnt'] = _number(record['member_amnt'], int)
+            record['team_id'] = _number(record['team_id'], int)
+            batch.append(record)
+            if len(batch) == chunk_size:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema))
+                batch = []
+                yield sink.drain()
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema))
+    yield sink.drain()
+
+def export_responses(survey_config, filters, fmt='csv', chunk_size=CHUNK_SIZE, path=None):
+    """Stream matching responses in the given format; yields str (csv, jsonl) or bytes (parquet).
+
+    The format and role are checked here, before anything is streamed. The generator
+    opens its own connection and closes it when exhausted or closed.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if fmt == 'parquet':
+        require_pyarrow()
+    rating_columns, open_columns = export_columns(survey_config, filters.get('role'))
+
+    def stream():
+        conn = database.connect(path)
+        records = iter_responses(conn, filters, chunk_size)
+        try:
+            if fmt == 'csv':
+                yield from write_csv(records, rating_columns, open_columns, chunk_size)
+            elif fmt == 'jsonl':
+                yield from write_jsonl(records, chunk_size)
+            else:
+                yield from write_parquet(records, rating_columns, open_columns, chunk_size)
+        finally:
+            records.close()
+            conn.close()
+    return stream()
@@ -1,194 +1,367 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, json, jsonify
+from flask import (Blueprint, Flask, Response, current_app, render_template, request, redirect, url_for, flash,
+                   session, json, jsonify, g, has_app_context, send_file)
 from flask_httpauth import HTTPBasicAuth
-from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import numpy as np
+from werkzeug.security import generate_password_hash
+from werkzeug.http import is_resource_modified
 import os
 from datetime import datetime
 import base64
-from io import BytesIO
 import json
-app = Flask(__name__)
+import sys
+import threading
+import atexit
+import time
+import uuid
+from collections import deque
 import config
-app.secret_key = config.SECRET_KEY
-users = None
-# Load survey configuration
-def load_config():
-    with open('admins.json',"r") as f:
-        global users
-        users = {k:generate_password_hash(v) for k,v in json.load(f).items()}
-    with open('config/survey_config.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
+import database
+from database import (init_db, get_db_connection, rebuild_aggregates, insert_response,
+                      response_filter_clauses)
+from caches import DiskCache, LRUCache
+from charts import ChartCache, ChartRenderPool, CHART_MIMETYPES
+from pages import PageCache
+from report import ReportBusy, ReportJob, build_report, REPORT_FILE
+import click
+from export import export_responses, EXPORT_FORMATS
+import metrics
+from survey import ConfigService
+from submissions import SubmissionWriter
+# Every route and command; create_app() registers it on an app
+bp = Blueprint('survey', __name__, cli_group=None)
+
+def should_profile():
+    """Profile requests that ask for it with ?profile=1 and carry admin credentials"""
+    credentials = request.authorization
+    return (request.args.get('profile') == '1' and credentials is not None
+            and verify_password(credentials.username, credentials.password) is not None)
+# Survey configuration and admin users, reloaded when their files change
+config_service = ConfigService('config/survey_config.json', 'admins.json', database.connect,
+                               getattr(config, 'CONFIG_CHECK_INTERVAL', 2),
+                               getattr(config, 'AUTH_CACHE_TTL', 300))
 auth = HTTPBasicAuth()
-CONFIG = load_config()
+
+@bp.before_app_request
+def check_config():
+    config_service.check()
+
+def get_survey():
+    """The compiled survey config, the same one for the whole of a request"""
+    if not has_app_context():
+        return config_service.survey
+    if 'survey' not in g:
+        g.survey = config_service.survey
+    return g.survey
+
+def get_config():
+    """survey_config.json as loaded, see get_survey()"""
+    return get_survey().raw
 
 @auth.verify_password
 def verify_password(username, password):
-    if username in users and check_password_hash(users.get(username), password):
+    # Checked against the KDF once, then from a short-lived in-memory cache
+    if config_service.users.verify(username, password):
         return username
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect('survey.db')
-    c = conn.cursor()
-    
-    # Create main responses table
-    c.execute('''CREATE TABLE IF NOT EXISTS responses
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  timestamp TEXT,
-                  role TEXT,
-                  respondent_name TEXT,
-                  member_cost REAL,
-                  member_amnt INTEGER,
-                  team_id INTEGER,
-                  mail TEXT,
-                  industry TEXT,
-                  company TEXT,
-                  job TEXT)''')
-    
-    # Create table for rating questions
-    c.execute('''CREATE TABLE IF NOT EXISTS ratings
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  response_id INTEGER,
-                  role TEXT,
-                  category TEXT,
-                  question TEXT,
-                  rating INTEGER,
-                  FOREIGN KEY (response_id) REFERENCES responses (id))''')
-    
-    # Create table for open questions
-    c.execute('''CREATE TABLE IF NOT EXISTS open_answers
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  response_id INTEGER,
-                  question TEXT,
-                  answer TEXT,
-                  FOREIGN KEY (response_id) REFERENCES responses (id))''')
-    
-    conn.commit()
-    conn.close()
+chart_cache = ChartCache(getattr(config, 'CHART_CACHE_SIZE', 256),
+                         getattr(config, 'CHART_CACHE_DIR', None))
+chart_pool = ChartRenderPool(chart_cache, getattr(config, 'CHART_RENDER_WORKERS', None),
+                             on_render=lambda fmt, seconds: metrics.chart_render_seconds.observe(seconds, fmt))
+metrics.registry.add_cache('chart', chart_cache.stats)
+
+# / and /survey/<role> as bytes, per config version and team
+page_cache = PageCache(getattr(config, 'PAGE_CACHE_SIZE', 1024))
+metrics.registry.add_cache('page', page_cache.stats)
+
+def spider_chart_key(values, categories, title, fmt='png'):
+    """Cache key (and ETag) of a spider chart; returns the key, normalized values and labels"""
+    # Values are shown with one decimal, so anything finer can't change the picture
+    values = [round(float(v), 1) for v in values]
+    survey = get_survey()
+    labels = [survey.category_name(cat) for cat in categories]
+    return ChartCache.make_key(values, list(categories), title, labels, fmt), values, labels
 
-def get_db_connection():
-    conn = sqlite3.connect('survey.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+def submit_spider_chart(values, categories, title, fmt='png'):
+    """Start rendering a spider chart in the render pool unless it is cached or in flight"""
+    key, values, labels = spider_chart_key(values, categories, title, fmt)
+    return chart_pool.submit(key, values, labels, title, fmt)
+
+def get_spider_chart_image(values, categories, title, fmt='png'):
+    """Return image bytes for a spider chart, rendering only on a cache miss"""
+    with metrics.timed('chart'):
+        return submit_spider_chart(values, categories, title, fmt).result()
 
 def generate_spider_chart(values, categories, title):
     """Generate a spider/radar chart"""
-    TITLE_FORMAT = "{0}\nИндекс максимума команды - {1}/10"
-    CATEG_FORMAT = "{0} ({1}/10)"
-    # Number of variables
-    N = len(categories)
-    
-    # Compute angle for each axis
-    angles = [n / float(N) * 2 * np.pi for n in range(N)]
-    angles += angles[:1]  # Complete the loop
-    
-    # Values should be between 0-10
-    values = list(values) + values[:1]  # Complete the loop
-    
-    # Initialize the spider plot
-    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(projection='polar'))
-    
-    # Draw one line per variable and fill area
-    ax.plot(angles, values, 'o-', linewidth=2, color='blue')
-    ax.fill(angles, values, alpha=0.25, color='blue')
-    
-    # Set category labels
-    category_labels = [CATEG_FORMAT.format(CONFIG['categories'].get(cat, cat),f"{values[i]:.1f}") for i,cat in enumerate(categories)]
-    ax.set_xticks(angles[:-1])
-    ax.set_xticklabels(category_labels, size=10)
-    
-    # Set y-axis limits
-    ax.set_ylim(0, 10)
-    ax.set_yticks(range(0, 11, 2))
-    ax.set_yticklabels(map(str, range(0, 11, 2)), size=8)
-    ax.grid(True)
-    
-    # Add title
-    plt.title(TITLE_FORMAT.format(title,f"{sum(values)/len(values):.1f}"), size=15, y=1.1)
-    
-    # Save to BytesIO object
-    img = BytesIO()
-    plt.savefig(img, format='png', dpi=100, bbox_inches='tight')
-    img.seek(0)
-    plt.close()
-    
     # Encode to base64 for embedding in HTML
-    plot_url = base64.b64encode(img.getvalue()).decode()
+    plot_url = base64.b64encode(get_spider_chart_image(values, categories, title)).decode()
     return plot_url
 
-def get_average_responses_by_role(role=None,t_id=None):
-    """Calculate average responses, optionally filtered by role"""
+class DashboardData:
+    """All role x category aggregates of one dashboard scope (every team or a single team)"""
+    def __init__(self, t_id, version, cells, role_rows, open_answer_count):
+        self.t_id = t_id
+        # Snapshot version (or newest response id) the numbers were computed from
+        self.version = version
+        # (role, category) -> (rating_sum, rating_count)
+        self.cells = cells
+        # role -> {'response_count', 'last_timestamp'}
+        self.roles = role_rows
+        self.open_answer_count = open_answer_count
+
+    def _role_rows(self, role=None):
+        if role is None:
+            return list(self.roles.values())
+        return [self.roles[role]] if role in self.roles else []
+
+    def _totals(self, role=None):
+        totals = {}
+        for (cell_role, category), (rating_sum, rating_count) in self.cells.items():
+            if role is None or cell_role == role:
+                old_sum, old_count = totals.get(category, (0, 0))
+                totals[category] = (old_sum + rating_sum, old_count + rating_count)
+        return totals
+
+    def averages(self, role=None):
+        """Average rating per category, optionally for one role"""
+        return {category: rating_sum / rating_count
+                for category, (rating_sum, rating_count) in self._totals(role).items()
+                if rating_count}
+
+    def chart_values(self, role=None):
+        """Categories and values in the order a spider chart expects"""
+        averages = self.averages(role)
+        survey_config = get_config()
+        if role and role in survey_config:
+            categories = list(survey_config[role].keys())
+        else:
+            categories = list(survey_config['categories'].keys())
+        # Categories without answers yet are drawn in the middle of the scale
+        return categories, [averages.get(cat, 5) for cat in categories]
+
+    def category_stats(self, role=None):
+        """Rows of category, average rating and number of ratings"""
+        return [{'category': category,
+                 'avg_rating': rating_sum / rating_count,
+                 'rating_count': rating_count}
+                for category, (rating_sum, rating_count) in sorted(self._totals(role).items())]
+
+    def stats(self, role=None):
+        """Headline numbers for the admin, group and role pages"""
+        totals = self._totals(role).values()
+        rating_sum = sum(total[0] for total in totals)
+        rating_count = sum(total[1] for total in totals)
+        avg_rating = rating_sum / rating_count if rating_count else None
+        return {'total_responses': sum(row['response_count'] for row in self._role_rows(role)),
+                'total_ratings': rating_count,
+                'total_open_answers': self.open_answer_count,
+                'overall_avg_rating': avg_rating,
+                'avg_rating': avg_rating}
+
+    def last_modified(self, role=None):
+        """Time of the newest response in scope, for Last-Modified headers"""
+        timestamps = [row['last_timestamp'] for row in self._role_rows(role) if row['last_timestamp']]
+        return parse_timestamp(max(timestamps)) if timestamps else None
+
+# Array-backed copy of responses and ratings that dashboards and statistics are computed from,
+# loaded by the first request that needs it
+snapshot = None
+snapshot_lock = threading.Lock()
+# Background writer for submissions when WRITE_BEHIND is on, see startup()
+submission_writer = None
+# Seconds between checks for responses submitted through other processes
+SNAPSHOT_REFRESH_INTERVAL = getattr(config, 'SNAPSHOT_REFRESH_INTERVAL', 5)
+snapshot_refreshed_at = 0
+
+def refresh_snapshot(conn=None):
+    """Append rows inserted since the last refresh to the snapshot, if it is loaded"""
+    global snapshot_refreshed_at
+    if snapshot is None:
+        return
+    snapshot.refresh(conn or get_db_connection())
+    snapshot_refreshed_at = time.monotonic()
+
+def get_snapshot():
+    """The snapshot, refreshed if another process may have added responses meanwhile"""
+    global snapshot, snapshot_refreshed_at
+    if snapshot is None:
+        with snapshot_lock:
+            if snapshot is None:
+                # NumPy comes with the snapshot, so pages without statistics start without it
+                import analytics
+                loaded = analytics.SurveySnapshot(get_config())
+                loaded.refresh(get_db_connection())
+                snapshot_refreshed_at = time.monotonic()
+                snapshot = loaded
+    elif time.monotonic() - snapshot_refreshed_at >= SNAPSHOT_REFRESH_INTERVAL:
+        refresh_snapshot()
+    return snapshot
+
+def snapshot_team(t_id):
+    """Team id of a ?t= value as stored and keyed by the snapshot: an int, or the text as typed"""
+    if t_id is None:
+        return None
+    try:
+        return int(t_id)
+    except ValueError:
+        return t_id
+
+# (source, team, version) -> DashboardData; bounded, since ?t= comes from public URLs
+dashboard_cache = LRUCache(getattr(config, 'DASHBOARD_CACHE_SIZE', 256))
+metrics.registry.add_cache('dashboard', dashboard_cache.stats)
+
+@config_service.add_listener
+def config_reloaded(survey):
+    """Drop cached pages and charts built with the previous config's names and questions"""
+    dashboard_cache.clear()
+    chart_cache.clear()
+    page_cache.clear()
+
+def aggregate_dashboard_data(team_id, last_response_id):
+    """DashboardData from category_aggregates and the responses table, in two grouped queries"""
     conn = get_db_connection()
-    
-    if role:
-        # Get all ratings for specific role
-        query = f'''SELECT rt.category, AVG(rt.rating) as avg_rating
-                   FROM ratings rt
-                   LEFT JOIN responses r ON rt.response_id = r.id
-                   WHERE rt.role = ?{' AND r.team_id = ?' if t_id else ''}
-                   GROUP BY rt.category'''
-        result = conn.execute(query, (role,t_id) if t_id else (role,)).fetchall()
-    else:
-        # Get all ratings across all roles
-        query = f'''SELECT rt.category, AVG(rt.rating) as avg_rating
-                   FROM ratings rt
-                   LEFT JOIN responses r ON rt.response_id = r.id
-                   {'WHERE r.team_id = ?' if t_id else ''}
-                   GROUP BY rt.category'''
-        result = conn.execute(query,(t_id,) if t_id else ()).fetchall()
-    
-    conn.close()
-    
-    if result:
-        averages = {row['category']: row['avg_rating'] for row in result}
-        return averages
-    else:
-        # Return default values if no data
-        return {cat: 5 for cat in CONFIG['categories'].keys()}
+    team_filter = 'WHERE team_id = ?' if team_id is not None else ''
+    params = (team_id,) if team_id is not None else ()
+    cells = {(row['role'], row['category']): (row['rating_sum'], row['rating_count'])
+             for row in conn.execute(f'''SELECT role, category,
+                                     SUM(rating_sum) as rating_sum,
+                                     SUM(rating_count) as rating_count
+                                     FROM category_aggregates {team_filter}
+                                     GROUP BY role, category''', params)}
+    role_rows = {}
+    open_answer_count = 0
+    for row in conn.execute(f'''SELECT role, COUNT(*) as response_count,
+                               MAX(timestamp) as last_timestamp,
+                               SUM(open_count) as open_count
+                               FROM responses {team_filter}
+                               GROUP BY role''', params):
+        role_rows[row['role']] = {'response_count': row['response_count'],
+                                  'last_timestamp': row['last_timestamp']}
+        open_answer_count += row['open_count'] or 0
+    return DashboardData(team_id, last_response_id, cells, role_rows, open_answer_count)
 
-def get_role_averages_for_chart(role=None,t_id=None):
-    """Get averages in format suitable for spider chart"""
-    averages = get_average_responses_by_role(role,t_id)
-    
-    # Get categories for this role or all categories
-    if role and role in CONFIG:
-        categories = list(CONFIG[role].keys())
-    else:
-        categories = list(CONFIG['categories'].keys())
-    
-    # Create values in the same order as categories
-    values = [averages.get(cat, 5) for cat in categories]
-    
-    return categories, values
+def get_dashboard_data(t_id=None):
+    """Every aggregate a dashboard page or chart needs.
+
+    Computed from the snapshot once this process has loaded it; until then from
+    category_aggregates, so a fresh worker serves dashboards without reading
+    every rating.
+    """
+    team_id = snapshot_team(t_id)
+    if snapshot is None:
+        # Responses are append-only, so the newest id tells whether anything changed
+        last_response_id = get_db_connection().execute('SELECT MAX(id) FROM responses').fetchone()[0]
+        key = ('aggregates', team_id, last_response_id)
+        data = dashboard_cache.get(key)
+        if data is None:
+            data = aggregate_dashboard_data(team_id, last_response_id)
+            dashboard_cache.put(key, data)
+        return data
+    current = get_snapshot()
+    key = ('snapshot', team_id, current.version)
+    data = dashboard_cache.get(key)
+    if data is None:
+        with current.lock:
+            sums, counts = current.category_means(team_id)
+            cells = {(current.roles[r], current.categories[c]): (int(sums[r, c]), int(counts[r, c]))
+                     for r, c in zip(*counts.nonzero())}
+            role_rows, open_answer_count = current.response_stats(team_id)
+            data = DashboardData(team_id, current.version, cells, role_rows, open_answer_count)
+        dashboard_cache.put(key, data)
+    return data
+
+def question_stats(current, team_id=None, role=None):
+    """Per-question distributions in questionnaire order, with display names"""
+    survey = get_survey()
+    # Copies: the snapshot hands out its memoised rows
+    rows = [dict(row, category_display=survey.category_name(row['category']),
+                 role_display=survey.role_name(row['role']))
+            for row in current.question_stats(team_id, role)]
+    return sorted(rows, key=lambda row: survey.question_position(row['role'], row['category'], row['question']))
+
+def gap_rows(current, survey, team_id=None):
+    """Rows of the role gap table between the config's gap_roles, with display names"""
+    first, second = survey.gap_roles
+    rows = current.role_gap(first, second, team_id)
+    for row in rows:
+        row.update(category_display=survey.category_name(row['category']),
+                   first_display=survey.role_name(first), second_display=survey.role_name(second))
+    return rows
+
+def team_analytics(t_id):
+    """Distribution, role gap and team vs company sections of a team page"""
+    team_id = snapshot_team(t_id)
+    current = get_snapshot()
+    survey = get_survey()
+    gap = gap_rows(current, survey, team_id)
+    deltas = current.team_deltas(team_id)
+    for row in deltas:
+        row['category_display'] = survey.category_name(row['category'])
+    for row in deltas:
+        row['role_display'] = survey.role_name(row['role'])
+    return {'questions': question_stats(current, team_id), 'gap': gap, 'deltas': deltas}
+
+# Responses never change once written, so everything their pages and charts need is
+# read once and kept by response id (in memory, and on disk with RESPONSE_CACHE_DIR)
+response_cache = DiskCache(getattr(config, 'RESPONSE_CACHE_SIZE', 1024),
+                           getattr(config, 'RESPONSE_CACHE_DIR', None))
+metrics.registry.add_cache('response', response_cache.stats)
+
+def get_response_payload(response_id):
+    """Fields, ratings and open answers of a response as plain dicts, or None if there is no such response"""
+    key = f"response-{response_id}.json"
+    cached = response_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    conn = get_db_connection()
+    response = conn.execute('SELECT * FROM responses WHERE id = ?', (response_id,)).fetchone()
+    if not response:
+        return None
+    ratings = conn.execute('''SELECT q.category, q.question, rt.rating
+                              FROM ratings rt JOIN questions q ON q.id = rt.question_id
+                              WHERE rt.response_id = ?
+                              ORDER BY rt.id''', (response_id,)).fetchall()
+    open_answers = conn.execute('''SELECT question, answer FROM open_answers
+                                   WHERE response_id = ?
+                                   ORDER BY id''', (response_id,)).fetchall()
+    payload = {'response': dict(response),
+               'ratings': [dict(row) for row in ratings],
+               'open_answers': [dict(row) for row in open_answers]}
+    response_cache.put(key, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+    return payload
+
+def find_response(submission_key):
+    """Id of the response stored under a submission key, or None"""
+    key = f"submission-{submission_key}"
+    cached = response_cache.get(key)
+    if cached is not None:
+        return int(cached)
+    row = get_db_connection().execute('SELECT id FROM responses WHERE submission_key = ?',
+                                      (submission_key,)).fetchone()
+    if not row:
+        return None
+    response_cache.put(key, str(row['id']).encode())
+    return row['id']
 
 def get_user_responses_for_chart(response_id):
     """Get a specific user's responses for spider chart"""
-    conn = get_db_connection()
+    payload = get_response_payload(response_id)
     
-    # Get response details
-    response = conn.execute('SELECT * FROM responses WHERE id = ?', 
-                           (response_id,)).fetchone()
-    
-    if not response:
-        conn.close()
+    if not payload:
         return None, None, None
     
-    # Get ratings
-    ratings = conn.execute('''SELECT category, rating FROM ratings 
-                              WHERE response_id = ?''', (response_id,)).fetchall()
-    
-    conn.close()
+    return response_chart_values(payload)
+
+def response_chart_values(payload):
+    """Response fields, categories and values for the chart of a response payload"""
+    response = payload['response']
     
     # Organize ratings by category
-    rating_dict = {row['category']: row['rating'] for row in ratings}
+    rating_dict = {row['category']: row['rating'] for row in payload['ratings']}
     
     # Get categories for this role
-    if response['role'] in CONFIG:
-        categories = list(CONFIG[response['role']].keys())
+    survey_config = get_config()
+    if response['role'] in survey_config:
+        categories = list(survey_config[response['role']].keys())
     else:
         categories = list(rating_dict.keys())
     
@@ -196,34 +369,189 @@ def get_user_responses_for_chart(response_id):
     
     return response, categories, values
 
-@app.route('/')
+def parse_timestamp(timestamp):
+    """Turn a stored local timestamp into an aware datetime for HTTP headers"""
+    return datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').astimezone()
+
+def average_chart_title(role=None):
+    if role:
+        return f"Средние результаты - {get_config()['roles'][role]}"
+    return "Средний результат за все ответы"
+
+def response_chart_title(response, view=None):
+    role_display = get_survey().role_name(response['role'])
+    if view == 'results':
+        return f"Ваши результаты - {response['respondent_name']} ({role_display})"
+    return f"Результаты {response['respondent_name']} - {role_display} ({response['timestamp']})"
+
+def chart_response(values, categories, title, last_modified=None, max_age=0):
+    """Serve a chart image with validators so clients can revalidate with a 304"""
+    fmt = request.args.get('format', 'png')
+    if fmt not in CHART_MIMETYPES:
+        return jsonify({'error': 'Unsupported format'}), 400
+    key, _, _ = spider_chart_key(values, categories, title, fmt)
+    etag = key.split('.')[0]
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        # The key is known before rendering, so a revalidation costs no drawing
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(get_spider_chart_image(values, categories, title, fmt),
+                                      mimetype=CHART_MIMETYPES[fmt])
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if not max_age:
+        response.cache_control.must_revalidate = True
+    return response
+
+def get_average_chart_urls(t_id=None):
+    """Chart URLs for the per-role and overall average charts of a dashboard.
+
+    With worker processes the charts are queued in the render pool at the same time,
+    so they are drawn in parallel while the page is still on its way to the browser.
+    Without them the chart endpoints draw them when the browser asks.
+    """
+    data = get_dashboard_data(t_id)
+    role_charts = {}
+    for role, role_display in get_config()['roles'].items():
+        if chart_pool.workers:
+            categories, values = data.chart_values(role)
+            submit_spider_chart(values, categories, average_chart_title(role))
+        role_charts[role] = {
+            'display_name': role_display,
+            'chart_url': url_for('.role_chart', role=role, t=t_id)
+        }
+    if chart_pool.workers:
+        categories, values = data.chart_values()
+        submit_spider_chart(values, categories, average_chart_title())
+    return role_charts, url_for('.overall_chart', t=t_id)
+
+def parse_submission(survey, role, form):
+    """Validate a survey form; returns (Question, rating) pairs and open answers or raises ValueError"""
+    fields = survey.rating_fields[role]
+    ratings = []
+    open_answers = []
+    for key, value in form.items():
+        if key in fields:
+            rating = int(value)
+            if not 1 <= rating <= 10:
+                raise ValueError(f"Rating out of range: {key}={value}")
+            ratings.append((fields[key], rating))
+        elif key in survey.open_fields and value.strip():
+            open_answers.append((survey.open_fields[key], value))
+    return ratings, open_answers
+
+# Query string filters understood by the response listings
+RESPONSE_FILTERS = ('role', 't', 'industry', 'from', 'to')
+RESPONSES_PAGE_SIZE = getattr(config, 'RESPONSES_PAGE_SIZE', 50)
+
+def get_response_filters(**fixed):
+    """Listing filters from the query string; fixed ones (e.g. the page's role) win"""
+    filters = {key: request.args[key] for key in RESPONSE_FILTERS if request.args.get(key)}
+    filters.update({key: value for key, value in fixed.items() if value})
+    for key in ('from', 'to'):
+        if key in filters:
+            datetime.strptime(filters[key], '%Y-%m-%d')  # ValueError on anything else
+    return filters
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row['timestamp'], row['id']]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, response_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), int(response_id)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def list_responses(filters, cursor=None, limit=RESPONSES_PAGE_SIZE):
+    """One page of responses, newest first, and the cursor of the next page (None on the last).
+
+    Pages are keyed on (timestamp, id) rather than OFFSET, so any page costs the same.
+    """
+    clauses, params = response_filter_clauses(filters)
+    if cursor:
+        clauses.append('(timestamp, id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = get_db_connection().execute(f'''SELECT * FROM responses {where}
+                                           ORDER BY timestamp DESC, id DESC
+                                           LIMIT ?''', params + [limit + 1]).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def get_response_page(endpoint, **fixed):
+    """Responses, filters and next page URL for a listing page; bad filters are dropped"""
+    try:
+        filters = get_response_filters(**fixed)
+        responses, next_cursor = list_responses(filters, request.args.get('cursor'))
+    except ValueError:
+        flash('Некорректный фильтр', 'error')
+        filters = {key: value for key, value in fixed.items() if value}
+        responses, next_cursor = list_responses(filters)
+    # Fixed filters are the endpoint's own arguments (role in the path, t for /group)
+    next_url = url_for(endpoint, cursor=next_cursor, **filters) if next_cursor else None
+    return responses, filters, next_url
+
+def static_page(name, render, append_t_id):
+    """A page that depends only on the config and the team, served from page_cache.
+
+    render(append_t_id) renders the page. Pending flash messages are shown
+    in a page of their own, rendered as usual.
+    """
+    if '_flashes' in session:
+        return render(append_t_id)
+    page = page_cache.get(name, get_survey().version, append_t_id, render)
+    encoding = page.negotiate(request.accept_encodings)
+    etag = page.etag(encoding)
+    if not is_resource_modified(request.environ, etag=etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(page.variants[encoding], mimetype='text/html')
+        if encoding != 'identity':
+            response.content_encoding = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # The config can be reloaded at any time
+    response.cache_control.no_cache = True
+    return response
+
+@bp.route('/')
 def index():
     """Home page with role selection"""
-    return render_template('role_select.html', 
-                         roles=CONFIG['roles'],
-                         append_t_id=f"?t={request.args.get("t")}" if "t" in request.args.keys() else "")
+    def render(append_t_id):
+        return render_template('role_select.html',
+                               roles=get_config()['roles'],
+                               append_t_id=append_t_id)
+    return static_page('index', render, f"?t={request.args.get("t")}" if "t" in request.args.keys() else "")
 
-@app.route('/survey/<role>')
+@bp.route('/survey/<role>')
 def survey(role):
     """Show survey form for selected role"""
-    if role not in CONFIG:
+    survey_config = get_config()
+    if role not in survey_config:
         flash('Invalid role selected', 'error')
-        return redirect(url_for('index'))
-    
-    role_config = CONFIG[role]
-    categories = CONFIG['categories']
-    open_questions = CONFIG['open_questions']
-    roles = CONFIG['roles']
+        return redirect(url_for('.index'))
     
-    return render_template('survey.html', 
-                         role=role,
-                         roles=roles,
-                         role_config=role_config,
-                         categories=categories,
-                         open_questions=open_questions,
-                         append_t_id=f"?t={request.args.get("t")}" if request.args.get("t") else "")
+    role_config = survey_config[role]
+    categories = survey_config['categories']
+    open_questions = survey_config['open_questions']
+    roles = survey_config['roles']
 
-@app.route('/submit', methods=['POST'])
+    def render(append_t_id):
+        return render_template('survey.html',
+                               role=role,
+                               config_version=get_survey().version,
+                               roles=roles,
+                               role_config=role_config,
+                               categories=categories,
+                               open_questions=open_questions,
+                               append_t_id=append_t_id)
+    return static_page(f"survey/{role}", render, f"?t={request.args.get("t")}" if request.args.get("t") else "")
+
+@bp.route('/submit', methods=['POST'])
 def submit():
     """Handle survey submission"""
     if request.method != 'POST': return
@@ -236,98 +564,123 @@ def submit():
     member_cost = request.form.get('member_cost', None)
     industry = request.form.get('industry', None)
     team_id = request.args.get("t")
+    # The config the form was rendered from, in case it has been reloaded since
+    survey = config_service.get(request.form.get('config_version'))
     
-    # Save main response
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO responses (timestamp, role, respondent_name, member_amnt, member_cost, team_id, mail, industry, company, job)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
-                    role, respondent_name, member_amnt, member_cost, team_id, respondent_mail, industry, respondent_company, respondent_job))
-    response_id = cursor.lastrowid
-    
-    # Save ratings
-    for key, value in request.form.items():
-        if key.startswith('rating_'):
-            # Parse key format: rating_category_question
-            parts = key.split('_')
-            if len(parts) >= 3:
-                category = parts[1]
-                question_idx = parts[2]
-                rating = int(value)
-                
-                # Get the actual question text from config
-                if role in CONFIG and category in CONFIG[role]:
-                    questions = CONFIG[role][category]
-                    if int(question_idx) < len(questions):
-                        question = questions[int(question_idx)]
-                        
-                        cursor.execute('''INSERT INTO ratings 
-                                        (response_id, role, category, question, rating)
-                                        VALUES (?, ?, ?, ?, ?)''',
-                                        (response_id, role, category, question, rating))
-    
-    # Save open answers
-    for key, value in request.form.items():
-        if key.startswith('open_') and value.strip():
-            # Parse key format: open_index
-            parts = key.split('_')
-            if len(parts) >= 2:
-                question_idx = int(parts[1])
-                if question_idx < len(CONFIG['open_questions']):
-                    question = CONFIG['open_questions'][question_idx]
-                    
-                    cursor.execute('''INSERT INTO open_answers 
-                                    (response_id, question, answer)
-                                    VALUES (?, ?, ?)''',
-                                    (response_id, question, value))
-    
-    conn.commit()
-    conn.close()
-    
-    # Store in session for immediate display
-    session['last_response_id'] = response_id
+    if role not in survey.rating_fields:
+        flash('Invalid role selected', 'error')
+        return redirect(url_for('.index'))
+    
+    # Validate the whole form before touching the database
+    try:
+        ratings, open_answers = parse_submission(survey, role, request.form)
+    except ValueError:
+        flash('Некорректные ответы, попробуйте ещё раз', 'error')
+        return redirect(url_for('.survey', role=role, t=team_id))
+    
+    # Everything is prepared up front so the write lock is held only for the inserts
+    submission = {'key': uuid.uuid4().hex,
+                  'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  'role': role, 'respondent_name': respondent_name, 'member_amnt': member_amnt,
+                  'member_cost': member_cost, 'team_id': team_id, 'mail': respondent_mail,
+                  'industry': industry, 'company': respondent_company, 'job': respondent_job,
+                  'config_version': survey.version,
+                  'ratings': [[question.id, question.category, rating] for question, rating in ratings],
+                  'open_answers': [[question, answer] for question, answer in open_answers]}
+    if submission_writer:
+        # Written by the background writer; /results waits for it by key
+        submission_writer.enqueue(submission)
+        session.pop('last_response_id', None)
+        session['last_submission'] = submission['key']
+    else:
+        conn = get_db_connection()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            response_id = insert_response(cursor, submission)
+        refresh_snapshot(conn)
+        if chart_pool.workers:
+            # Start drawing the results chart while the browser follows the redirect
+            # (without worker processes that would draw it here, holding up the redirect)
+            response, categories, values = get_user_responses_for_chart(response_id)
+            submit_spider_chart(values, categories, response_chart_title(response, 'results'))
+        # Store in session for immediate display
+        session['last_response_id'] = response_id
     
     flash('Спасибо за прохождение опроса!', 'success')
-    return redirect(url_for('results'))
+    return redirect(url_for('.results'))
+
+class RateLimiter:
+    """Sliding-window limit of calls per client"""
+    def __init__(self, limit, period, max_clients=10000):
+        self.limit = limit
+        self.period = period
+        self.max_clients = max_clients
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._calls) >= self.max_clients:
+                # Forget clients that have been quiet for a whole window
+                self._calls = {key: calls for key, calls in self._calls.items()
+                               if calls and calls[-1] > now - self.period}
+            calls = self._calls.setdefault(client, deque())
+            while calls and calls[0] <= now - self.period:
+                calls.popleft()
+            if len(calls) >= self.limit:
+                return False
+            calls.append(now)
+            return True
+
+# The survey page draws previews in the browser; this only guards the server fallback
+spider_limiter = RateLimiter(*getattr(config, 'SPIDER_RATE_LIMIT', (10, 60)))
 
-@app.route('/spider', methods=['POST'])
+@bp.route('/spider', methods=['POST'])
 def spider():
-    """Generate spider chart from submitted answers and return as base64 image"""
+    """Generate spider chart from submitted answers and return as base64 image.
+
+    Fallback for browsers that can't draw the preview themselves.
+    """
+    if not spider_limiter.allow(request.remote_addr):
+        return jsonify({'error': 'Too many requests'}), 429
+    
     data = request.get_json()
     
-    if not data or 'role' not in data or 'ratings' not in data:
+    if not isinstance(data, dict) or 'role' not in data or 'ratings' not in data:
         return jsonify({'error': 'Missing required data'}), 400
     
     role = data['role']
     ratings = data['ratings']
     
-    if role not in CONFIG:
+    survey = get_survey()
+    if role not in survey.rating_fields:
         return jsonify({'error': 'Invalid role'}), 400
+    if not isinstance(ratings, dict):
+        return jsonify({'error': 'Invalid rating'}), 400
     
-    role_config = CONFIG[role]
-    
-    categories = []
-    values = []
-
+    # Field names are resolved through the compiled config, not split on '_'
+    fields = survey.rating_fields[role]
     category_values = {}
+    try:
+        for key, value in ratings.items():
+            if key in fields:
+                # Same range as parse_submission(), so nothing else reaches the renderer
+                rating = int(value)
+                if not 1 <= rating <= 10:
+                    raise ValueError(f"Rating out of range: {key}={value}")
+                category_values.setdefault(fields[key].category, []).append(rating)
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': 'Invalid rating'}), 400
     
-    for key, value in ratings.items():
-        parts = key.split('_')
-        if len(parts) >= 3:
-            category_id = parts[1]
-            if category_id not in category_values:
-                category_values[category_id] = []
-            category_values[category_id].append(value)
-    
-    for category_id, question_values in category_values.items():
-        if category_id in CONFIG['categories']:
-            category_name = CONFIG['categories'][category_id]
-            categories.append(category_name)
-            avg_value = sum(question_values) / len(question_values)
-            values.append(avg_value)
-    
-    role_display = CONFIG['roles'].get(role, role)
+    categories = [category for category in survey.role_categories[role] if category in category_values]
+    values = [sum(category_values[category]) / len(category_values[category]) for category in categories]
+    
+    if not categories:
+        return jsonify({'error': 'Missing required data'}), 400
+    
+    role_display = survey.role_name(role)
     title = f"Предварительные результаты - {role_display}"
     
     chart_url = generate_spider_chart(values, categories, title)
@@ -336,277 +689,396 @@ def spider():
         'image': chart_url
     })
 
-@app.route('/results')
+# Seconds /results waits for a queued submission to be written
+SUBMISSION_WAIT = getattr(config, 'SUBMISSION_WAIT', 5)
+
+def find_submission(key, timeout=SUBMISSION_WAIT):
+    """Response id of a queued submission, waiting up to timeout for it to be written"""
+    deadline = time.monotonic() + timeout
+    while True:
+        # Returns at once unless the submission is still in this process's queue
+        response_id = submission_writer.wait(key, timeout) if submission_writer else None
+        if response_id is None:
+            # Queued by another worker process, or written long enough ago to be forgotten
+            response_id = find_response(key)
+        if response_id is not None or time.monotonic() >= deadline:
+            return response_id
+        time.sleep(0.05)
+
+@bp.route('/results')
 def results():
     """Show individual results with spider chart"""
+    if 'last_response_id' not in session and 'last_submission' in session:
+        response_id = find_submission(session['last_submission'])
+        if response_id is None:
+            flash('Ответ ещё сохраняется, обновите страницу через несколько секунд', 'error')
+            return redirect(url_for('.index'))
+        session['last_response_id'] = response_id
+        session.pop('last_submission')
     if 'last_response_id' not in session:
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     
     response_id = session['last_response_id']
-    response, categories, values = get_user_responses_for_chart(response_id)
+    payload = get_response_payload(response_id)
     
-    if not response:
+    if not payload:
         flash('Response not found', 'error')
-        return redirect(url_for('index'))
-    
-    role_display = CONFIG['roles'].get(response['role'], response['role'])
-    title = f"Ваши результаты - {response['respondent_name']} ({role_display})"
+        return redirect(url_for('.index'))
     
-    chart_url = generate_spider_chart(values, categories, title)
+    # Responses with a submission key have a stable URL that can be bookmarked or shared
+    if payload['response'].get('submission_key'):
+        return redirect(url_for('.shared_results', key=payload['response']['submission_key']))
+    return render_results(response_id)
+
+@bp.route('/results/<key>')
+def shared_results(key):
+    """Results of one response at its stable URL"""
+    response_id = find_response(key)
+    if response_id is None:
+        flash('Response not found', 'error')
+        return redirect(url_for('.index'))
+    return render_results(response_id, share_url=config.URL_START + url_for('.shared_results', key=key))
+
+def render_results(response_id, share_url=None):
+    """Results page of a response, built from its cached payload"""
+    payload = get_response_payload(response_id)
+    response, categories, values = response_chart_values(payload)
     
-    # Get open answers
-    conn = get_db_connection()
-    open_answers = conn.execute('''SELECT question, answer FROM open_answers 
-                                   WHERE response_id = ?''', 
-                               (response_id,)).fetchall()
-    conn.close()
+    role_display = get_survey().role_name(response['role'])
+    chart_url = url_for('.response_chart', response_id=response_id, view='results')
     
     return render_template('results.html', 
                          chart_url=chart_url,
+                         share_url=share_url,
                          respondent_name=response['respondent_name'],
                          role=role_display,
                          categories=categories,
                          values=values,
-                         open_answers=open_answers)
+                         open_answers=payload['open_answers'])
 
-@app.route('/admin')
+@bp.route('/admin')
 @auth.login_required
 def admin():
     """Admin page showing all responses and average charts"""
-    conn = get_db_connection()
-    
-    # Get all responses
-    responses = conn.execute('''SELECT r.*, 
-                               COUNT(DISTINCT rt.id) as rating_count,
-                               COUNT(DISTINCT oa.id) as open_count
-                               FROM responses r
-                               LEFT JOIN ratings rt ON r.id = rt.response_id
-                               LEFT JOIN open_answers oa ON r.id = oa.response_id
-                               GROUP BY r.id
-                               ORDER BY r.timestamp DESC''').fetchall()
+    # Get one page of responses
+    responses, filters, next_url = get_response_page('.admin')
     
     # Get statistics
-    stats = conn.execute('''SELECT 
-                           COUNT(DISTINCT r.id) as total_responses,
-                           COUNT(DISTINCT rt.id) as total_ratings,
-                           COUNT(DISTINCT oa.id) as total_open_answers,
-                           AVG(rt.rating) as overall_avg_rating
-                           FROM responses r
-                           LEFT JOIN ratings rt ON r.id = rt.response_id
-                           LEFT JOIN open_answers oa ON r.id = oa.response_id''').fetchone()
+    stats = get_dashboard_data().stats()
     
-    
-    
-    # Generate average charts for each role
-    role_charts = {}
-    for role in CONFIG['roles'].keys():
-        categories, values = get_role_averages_for_chart(role)
-        if values:
-            role_display = CONFIG['roles'][role]
-            chart_url = generate_spider_chart(
-                values, 
-                categories, 
-                f"Средние результаты - {role_display}"
-            )
-            role_charts[role] = {
-                'display_name': role_display,
-                'chart_url': chart_url,
-                'categories': categories,
-                'values': values
-            }
-    
-    # Generate overall average chart
-    all_categories = list(CONFIG['categories'].keys())
-    all_values = []
-    for cat in all_categories:
-        avg = conn.execute('SELECT AVG(rating) as avg FROM ratings WHERE category = ?',
-                          (cat,)).fetchone()
-        all_values.append(avg['avg'] if avg and avg['avg'] else 5)
-    conn.close()
-    
-    overall_chart = generate_spider_chart(
-        all_values,
-        all_categories,
-        "Средний результат за все ответы"
-    )
+    # Charts are fetched by the browser from their own cacheable endpoints
+    role_charts, overall_chart = get_average_chart_urls()
     
     return render_template('admin.html', 
                          responses=responses,
+                         filters=filters,
+                         next_url=next_url,
                          stats=stats,
                          role_charts=role_charts,
                          overall_chart=overall_chart,
-                         roles=CONFIG['roles'])
+                         roles=get_config()['roles'])
+
+@bp.route('/api/responses')
+@auth.login_required
+def api_responses():
+    """JSON variant of the response listing, with the same filters and cursor"""
+    try:
+        filters = get_response_filters()
+        limit = min(int(request.args.get('limit', RESPONSES_PAGE_SIZE)), 500)
+        responses, next_cursor = list_responses(filters, request.args.get('cursor'), max(limit, 1))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'responses': [{key: row[key] for key in ('id', 'timestamp', 'role', 'respondent_name', 'team_id',
+                                                 'industry', 'company', 'job', 'rating_count', 'open_count')}
+                      for row in responses],
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/admin/export')
+@auth.login_required
+def admin_export():
+    """Download responses with pivoted ratings and open answers, streamed as it is read"""
+    fmt = request.args.get('format', 'csv')
+    try:
+        stream = export_responses(get_config(), get_response_filters(), fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    filename = f"responses-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return Response(stream, content_type=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
-@app.route('/logout')
+@bp.route('/chart/overall')
+def overall_chart():
+    """Average chart over all responses, optionally for one team"""
+    data = get_dashboard_data(request.args.get("t"))
+    categories, values = data.chart_values()
+    return chart_response(values, categories, average_chart_title(), data.last_modified())
+
+@bp.route('/chart/role/<role>')
+def role_chart(role):
+    """Average chart for one role, optionally for one team"""
+    if role not in get_config()['roles']:
+        return jsonify({'error': 'Invalid role'}), 404
+    data = get_dashboard_data(request.args.get("t"))
+    categories, values = data.chart_values(role)
+    return chart_response(values, categories, average_chart_title(role), data.last_modified(role))
+
+@bp.route('/chart/response/<int:response_id>')
+def response_chart(response_id):
+    """Chart of a single response; responses never change, so it can be cached for long"""
+    response, categories, values = get_user_responses_for_chart(response_id)
+    if not response:
+        return jsonify({'error': 'Response not found'}), 404
+    return chart_response(values, categories,
+                          response_chart_title(response, request.args.get('view')),
+                          parse_timestamp(response['timestamp']), max_age=86400)
+
+# Cross-team report, built by `flask build-report` or in the background from /admin/report
+REPORT_DIR = getattr(config, 'REPORT_DIR', 'report')
+report_job = ReportJob()
+
+def build_team_report(directory=REPORT_DIR, full=False):
+    """Compare every team from the snapshot and write the report bundle, see report.build_report"""
+    survey = get_survey()
+    rows = get_snapshot().team_comparison(*survey.gap_roles)
+    return build_report(rows, survey, directory,
+                        lambda **context: render_template('report.html', **context),
+                        getattr(config, 'CHART_RENDER_WORKERS', None), full)
+
+@bp.route('/admin/report', methods=['GET', 'POST'])
+@auth.login_required
+def admin_report():
+    """The last cross-team report; POST starts a new build (?full=1 redraws every chart)"""
+    if request.method == 'POST':
+        app = current_app._get_current_object()
+        full = request.args.get('full') == '1'
+
+        def build():
+            with app.app_context():
+                return build_team_report(full=full)
+        started = report_job.start(build)
+        return jsonify(report_job.status()), 202 if started else 409
+    path = os.path.abspath(os.path.join(REPORT_DIR, REPORT_FILE))
+    if not os.path.exists(path):
+        return jsonify({'error': 'No report built yet', **report_job.status()}), 404
+    return send_file(path, mimetype='text/html')
+
+@bp.route('/admin/report/status')
+@auth.login_required
+def admin_report_status():
+    """Whether a report build is running, and the summary or error of the last one"""
+    return jsonify(report_job.status())
+
+@bp.route('/admin/chart-cache')
+@auth.login_required
+def chart_cache_stats():
+    """Hit/miss counters of the rendered chart cache"""
+    return jsonify(chart_cache.stats())
+
+@bp.route('/metrics')
+@auth.login_required
+def metrics_endpoint():
+    """Request latencies, per-phase timings and cache counters in Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/logout')
 def logout():
     """Log out the current user"""
     session.clear()
     
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/response/<int:response_id>')
+@bp.route('/response/<int:response_id>')
 def view_response(response_id):
     """View individual response with spider chart"""
-    response, categories, values = get_user_responses_for_chart(response_id)
+    payload = get_response_payload(response_id)
     
-    if not response:
+    if not payload:
         flash('Response not found', 'error')
-        return redirect(url_for('admin'))
+        return redirect(url_for('.admin'))
     
-    role_display = CONFIG['roles'].get(response['role'], response['role'])
-    title = f"Результаты {response['respondent_name']} - {role_display} ({response['timestamp']})"
+    response = payload['response']
+    role_display = get_survey().role_name(response['role'])
+    chart_url = url_for('.response_chart', response_id=response_id)
     
-    chart_url = generate_spider_chart(values, categories, title)
-    
-    # Get ratings details
-    conn = get_db_connection()
-    ratings = conn.execute('''SELECT category, question, rating 
-                             FROM ratings WHERE response_id = ?
-                             ORDER BY category''', (response_id,)).fetchall()
-    
-    # Get open answers
-    open_answers = conn.execute('''SELECT question, answer FROM open_answers 
-                                   WHERE response_id = ?''', 
-                               (response_id,)).fetchall()
-    conn.close()
+    # Ratings details and open answers come with the cached response
+    ratings = sorted(payload['ratings'], key=lambda row: row['category'])
     
     return render_template('view_response.html',
                          response=response,
                          chart_url=chart_url,
                          ratings=ratings,
-                         open_answers=open_answers,
+                         open_answers=payload['open_answers'],
                          role_display=role_display)
 
-@app.route('/role/<role>')
+@bp.route('/role/<role>')
 def role_stats(role):
     """View statistics for a specific role"""
-    if role not in CONFIG['roles']:
+    if role not in get_config()['roles']:
         flash('Invalid role', 'error')
-        return redirect(url_for('admin'))
+        return redirect(url_for('.admin'))
     
-    conn = get_db_connection()
+    # Get one page of responses for this role
+    responses, filters, next_url = get_response_page('.role_stats', role=role)
+    
+    # Get statistics and category averages for this role
+    data = get_dashboard_data()
+    stats = data.stats(role)
+    category_avgs = data.category_stats(role)
+    
+    role_display = get_config()['roles'][role]
+    chart_url = url_for('.role_chart', role=role)
     
-    # Get responses for this role
-    responses = conn.execute('''SELECT r.*, 
-                               COUNT(DISTINCT rt.id) as rating_count
-                               FROM responses r
-                               LEFT JOIN ratings rt ON r.id = rt.response_id
-                               WHERE r.role = ?
-                               GROUP BY r.id
-                               ORDER BY r.timestamp DESC''', 
-                           (role,)).fetchall()
-    
-    # Get statistics for this role
-    stats = conn.execute('''SELECT 
-                           COUNT(DISTINCT r.id) as total_responses,
-                           AVG(rt.rating) as avg_rating
-                           FROM responses r
-                           LEFT JOIN ratings rt ON r.id = rt.response_id
-                           WHERE r.role = ?''', (role,)).fetchone()
-    
-    # Get category averages
-    category_avgs = conn.execute('''SELECT category, AVG(rating) as avg_rating,
-                                   COUNT(*) as rating_count
-                                   FROM ratings 
-                                   WHERE role = ?
-                                   GROUP BY category''', (role,)).fetchall()
-    
-    conn.close()
-    
-    # Generate spider chart for this role
-    categories, values = get_role_averages_for_chart(role)
-    role_display = CONFIG['roles'][role]
-    chart_url = generate_spider_chart(
-        values, 
-        categories, 
-        f"Средние результаты - {role_display}"
-    )
+    # Answer distributions per question and the gap between the roles, company-wide
+    current = get_snapshot()
+    questions = question_stats(current, role=role)
+    gap = gap_rows(current, get_survey())
     
     return render_template('role_stats.html',
                          role=role,
                          role_display=role_display,
                          responses=responses,
+                         filters=filters,
+                         next_url=next_url,
                          stats=stats,
                          category_avgs=category_avgs,
-                         chart_url=chart_url,
-                         categories=categories,
-                         values=values)
+                         questions=questions,
+                         gap=gap,
+                         chart_url=chart_url)
 
-@app.route('/group')
+@bp.route('/group')
 def group():
     """Get a group link"""
     if (t_id:=request.args.get("t")):
-        conn = get_db_connection()
-        
-        # Get all responses
-        responses = conn.execute('''SELECT r.*, 
-                                COUNT(DISTINCT rt.id) as rating_count,
-                                COUNT(DISTINCT oa.id) as open_count
-                                FROM responses r
-                                LEFT JOIN ratings rt ON r.id = rt.response_id
-                                LEFT JOIN open_answers oa ON r.id = oa.response_id
-                                WHERE r.team_id = ?
-                                GROUP BY r.id
-                                ORDER BY r.timestamp DESC''',(t_id,)).fetchall()
+        # Get one page of the team's responses
+        responses, filters, next_url = get_response_page('.group', t=t_id)
         
         # Get statistics
-        stats = conn.execute('''SELECT 
-                            COUNT(DISTINCT r.id) as total_responses,
-                            COUNT(DISTINCT rt.id) as total_ratings,
-                            COUNT(DISTINCT oa.id) as total_open_answers,
-                            AVG(rt.rating) as overall_avg_rating
-                            FROM responses r
-                            LEFT JOIN ratings rt ON r.id = rt.response_id
-                            LEFT JOIN open_answers oa ON r.id = oa.response_id
-                            WHERE r.team_id = ?''',(t_id,)).fetchone()
-        
-        # Generate average charts for each role
-        role_charts = {}
-        for role in CONFIG['roles'].keys():
-            categories, values = get_role_averages_for_chart(role,t_id)
-            if values:
-                role_display = CONFIG['roles'][role]
-                chart_url = generate_spider_chart(
-                    values, 
-                    categories, 
-                    f"Средние результаты - {role_display}"
-                )
-                role_charts[role] = {
-                    'display_name': role_display,
-                    'chart_url': chart_url,
-                    'categories': categories,
-                    'values': values
-                }
+        stats = get_dashboard_data(t_id).stats()
         
-        # Generate overall average chart
-        all_categories = list(CONFIG['categories'].keys())
-        all_values = []
-        for cat in all_categories:
-            avg = conn.execute('SELECT AVG(rating) as avg FROM ratings rt LEFT JOIN responses r on r.id = rt.response_id WHERE rt.category = ? AND r.team_id = ?',
-                            (cat,t_id)).fetchone()
-            all_values.append(avg['avg'] if avg and avg['avg'] else 5)
-        conn.close()
-        overall_chart = generate_spider_chart(
-            all_values,
-            all_categories,
-            "Средний результат за все ответы"
-        )
+        # Charts are fetched by the browser from their own cacheable endpoints
+        role_charts, overall_chart = get_average_chart_urls(t_id)
         return render_template('admin.html', 
                          responses=responses,
+                         filters=filters,
+                         next_url=next_url,
                          stats=stats,
+                         team=team_analytics(t_id),
                          role_charts=role_charts,
                          overall_chart=overall_chart,
-                         roles=CONFIG['roles'])
+                         roles=get_config()['roles'])
 
     conn = get_db_connection()
-    t_id = conn.execute("SELECT MAX(team_id) FROM responses").fetchone()[0]
+    # Text ids sort after every integer in SQLite
+    t_id = conn.execute("SELECT MAX(team_id) FROM responses WHERE typeof(team_id) = 'integer'").fetchone()[0]
     if t_id is None: t_id = -1
-    link = config.URL_START+url_for("index",t=t_id+1)
-    group_link = config.URL_START+url_for("group",t=t_id+1)
+    link = config.URL_START+url_for(".index",t=t_id+1)
+    group_link = config.URL_START+url_for(".group",t=t_id+1)
     return render_template('group.html', link=link, group_link=group_link)
 
+@bp.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Recompute the category aggregate table from all stored ratings"""
+    conn = get_db_connection()
+    rebuild_aggregates(conn)
+    conn.commit()
+    dashboard_cache.clear()
+    print('Aggregates rebuilt')
+
+@bp.cli.command('build-report')
+@click.option('--output', '-o', type=click.Path(file_okay=False), help='Report directory (default: REPORT_DIR)')
+@click.option('--full', is_flag=True, help='Redraw every chart, not only those of teams with new responses')
+def build_report_command(output, full):
+    """Build the cross-team comparison report: report.html with every team's averages and chart"""
+    try:
+        summary = build_team_report(output or REPORT_DIR, full)
+    except ReportBusy as e:
+        raise click.ClickException(str(e))
+    print(f"{summary['path']}: {summary['teams']} teams, {summary['changed']} changed, "
+          f"{summary['charts_rendered']} charts drawn, {summary['charts_reused']} reused in {summary['seconds']}s")
+
+@bp.cli.command('hash-password')
+@click.password_option()
+def hash_password_command(password):
+    """Print a password hash to use as a value in admins.json instead of the password"""
+    print(generate_password_hash(password))
+
+@bp.cli.command('export-responses')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='File to write (default: stdout)')
+@click.option('--role')
+@click.option('--team', 't', help='Team id (?t=)')
+@click.option('--industry')
+@click.option('--from', 'date_from', help='First day, YYYY-MM-DD')
+@click.option('--to', 'date_to', help='Last day, YYYY-MM-DD')
+def export_responses_command(fmt, output, role, t, industry, date_from, date_to):
+    """Export responses with their ratings and open answers without copying survey.db"""
+    filters = {key: value for key, value in (('role', role), ('t', t), ('industry', industry),
+                                             ('from', date_from), ('to', date_to)) if value}
+    for key in ('from', 'to'):
+        if key in filters:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                raise click.BadParameter(f"expected YYYY-MM-DD, got {filters[key]}", param_hint=f'--{key}')
+    try:
+        stream = export_responses(get_config(), filters, fmt)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--role')
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    binary = fmt == 'parquet'
+    if output:
+        f = open(output, 'wb' if binary else 'w', encoding=None if binary else 'utf-8', newline=None if binary else '')
+    else:
+        f = sys.stdout.buffer if binary else sys.stdout
+    try:
+        for chunk in stream:
+            f.write(chunk)
+    finally:
+        if output:
+            f.close()
+
+def startup():
+    """Bring the schema up to date, load the config and start the write-behind writer.
+
+    On a current database this only reads. Charts, NumPy and the snapshot are
+    left for the first request that needs them.
+    """
+    global submission_writer
+    init_db()
+    config_service.load()
+    if getattr(config, 'WRITE_BEHIND', False) and submission_writer is None:
+        submission_writer = SubmissionWriter(getattr(config, 'WRITE_SPOOL_DIR', 'spool'), database.connect,
+                                             getattr(config, 'WRITE_BATCH_SIZE', 200),
+                                             getattr(config, 'WRITE_SPOOL_FSYNC', False),
+                                             on_commit=refresh_snapshot)
+        submission_writer.start()
+        atexit.register(submission_writer.close)
+
+def create_app():
+    """The survey app: gunicorn 'main:create_app()', or main:app for the default instance"""
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.secret_key = config.SECRET_KEY
+    # Request timings for /metrics; sampled profiles are written to PROFILE_DIR when it is set
+    metrics.init_app(app, getattr(config, 'PROFILE_DIR', None), should_profile)
+    database.init_app(app, getattr(config, 'DATABASE_PATH', None), getattr(config, 'SQLITE_PRAGMAS', None))
+    app.register_blueprint(bp)
+    startup()
+    app.logger.info('App started in %.0f ms', (time.perf_counter() - started) * 1000)
+    return app
 
+def __getattr__(name):
+    # main.app is created on first access, so importing this module has no side effects
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-init_db()
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,258 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+
+# Seconds; the Prometheus client defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+class Histogram:
+    """Bucketed observations per label set, rendered as a Prometheus histogram"""
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        for label_values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                labels = _format_labels([*self.labels, 'le'], [*label_values, bound])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class CounterMetric:
+    """Monotonic count per label set, rendered as a Prometheus counter"""
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f'{self.name}{_format_labels(self.labels, label_values)} {value}'
+                  for label_values, value in values]
+        return lines
+
+class Registry:
+    """Metrics of this process plus caches whose counters are read when scraped"""
+    def __init__(self):
+        self.metrics = []
+        # name -> callable returning a dict with 'hits', 'misses' and 'size'
+        self.caches = {}
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        metric = CounterMetric(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def add_cache(self, name, stats):
+        self.caches[name] = stats
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        cache_stats = {name: stats() for name, stats in sorted(self.caches.items())}
+        for key, kind, help in (('hits', 'counter', 'Cache lookups that found an entry'),
+                                ('misses', 'counter', 'Cache lookups that found nothing'),
+                                ('size', 'gauge', 'Entries currently cached')):
+            name = f'survey_cache_{key}_total' if kind == 'counter' else f'survey_cache_{key}'
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_format_labels(["cache"], [cache])} {stats[key]}'
+                      for cache, stats in cache_stats.items()]
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+request_seconds = registry.histogram('survey_request_duration_seconds',
+                                     'Time from the start of a request to its response', ('endpoint', 'method'))
+requests_total = registry.counter('survey_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+phase_seconds = registry.histogram('survey_request_phase_seconds',
+                                   'Time spent per request in db, chart and template work', ('endpoint', 'phase'))
+db_queries = registry.histogram('survey_db_queries_per_request', 'SQL statements executed per request',
+                                ('endpoint',), QUERY_COUNT_BUCKETS)
+chart_render_seconds = registry.histogram('survey_chart_render_seconds',
+                                          'Time to draw a chart that was not cached, queueing included',
+                                          ('format',))
+
+class RequestStats:
+    """Phase timings of the request being handled"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        # phase -> seconds
+        self.phases = Counter()
+        self.queries = 0
+        self.status = None
+
+def current():
+    """RequestStats of the current request, or None outside one"""
+    return g.get('request_stats') if has_request_context() else None
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to a phase of the current request"""
+    stats = current()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.phases[phase] += time.perf_counter() - started
+
+def record_query(seconds, statements=1):
+    """Count SQL work done on behalf of the current request; see database.TimedCursor"""
+    stats = current()
+    if stats is not None:
+        stats.phases['db'] += seconds
+        stats.queries += statements
+
+class SamplingProfiler:
+    """Samples one thread's stack at an interval and counts them in folded-stack form.
+
+    The output (one "frame;frame;frame count" line per distinct stack) is what
+    flamegraph.pl and speedscope read.
+    """
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+def init_app(app, profile_dir=None, should_profile=None):
+    """Time every request of app; with profile_dir, profile requests should_profile() picks.
+
+    Profiles are written to profile_dir, one file per request, named in the
+    X-Profile response header.
+    """
+    profile_lock = threading.Lock()
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats()
+        # One profiled request at a time, so profiling can't be used to load the server
+        if profile_dir and should_profile and should_profile() and profile_lock.acquire(blocking=False):
+            g.profiler = SamplingProfiler(threading.get_ident()).start()
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = current()
+        if stats is not None:
+            stats.status = response.status_code
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            profile_lock.release()
+            os.makedirs(profile_dir, exist_ok=True)
+            filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint}.folded"
+            profiler.dump(os.path.join(profile_dir, filename))
+            response.headers['X-Profile'] = filename
+        return response
+
+    @app.teardown_request
+    def record_request_stats(exception=None):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return
+        profiler = g.pop('profiler', None)
+        if profiler is not None:  # after_request didn't run
+            profiler.stop()
+            profile_lock.release()
+        # Unmatched URLs share one label so scanners can't blow up the series count
+        endpoint = request.endpoint or 'unmatched'
+        request_seconds.observe(time.perf_counter() - stats.started, endpoint, request.method)
+        requests_total.inc(endpoint, request.method, stats.status or 500)
+        for phase, seconds in stats.phases.items():
+            phase_seconds.observe(seconds, endpoint, phase)
+        db_queries.observe(stats.queries, endpoint)
+
+    def template_started(sender, template, context, **extra):
+        stats = current()
+        if stats is not None:
+            g.template_started = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        started = g.pop('template_started', None)
+        stats = current()
+        if stats is not None and started is not None:
+            stats.phases['template'] += time.perf_counter() - started
+
+    # Strong references: the receivers are local functions
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
@@ -0,0 +1,76 @@
+import gzip
+import hashlib
+import threading
+
+from markupsafe import escape
+
+try:
+    import brotli
+except ImportError:  # optional, pip install brotli; pages are then offered gzipped only
+    brotli = None
+
+from caches import LRUCache
+
+# Rendered where the ?t= suffix goes and replaced per team, see PageCache
+TEAM_PLACEHOLDER = '@@team-suffix@@'
+
+# Every team's page is compressed on its first request, so neither level is the maximum
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+
+class Page:
+    """Bytes of a rendered page with precompressed variants and a strong ETag per variant"""
+    def __init__(self, body):
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, GZIP_LEVEL, mtime=0)}
+        if brotli:
+            self.variants['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    def negotiate(self, accept_encodings):
+        """Smallest variant the client accepts (brotli, gzip or none), given request.accept_encodings"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+    def etag(self, encoding):
+        # Byte-for-byte different variants need different strong ETags
+        return self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+
+class PageCache:
+    """Pages that only change with the config, rendered once per config version.
+
+    render is called with TEAM_PLACEHOLDER as the team suffix, and its output
+    is split there; the page of a team is the parts joined with its escaped
+    suffix, so a new team costs a join and a compression, not a render. Pages
+    are kept per (name, version, suffix) in a bounded LRUCache.
+    """
+    def __init__(self, max_entries=1024):
+        # (name, version) -> page bytes split at the placeholder
+        self._parts = {}
+        self._pages = LRUCache(max_entries)
+        self._lock = threading.Lock()
+
+    def get(self, name, version, suffix, render):
+        key = (name, version, suffix)
+        page = self._pages.get(key)
+        if page is not None:
+            return page
+        with self._lock:
+            parts = self._parts.get((name, version))
+        if parts is None:
+            parts = render(TEAM_PLACEHOLDER).encode('utf-8').split(TEAM_PLACEHOLDER.encode('utf-8'))
+            with self._lock:
+                self._parts[(name, version)] = parts
+        # The suffix is escaped as Jinja would have escaped it in the template
+        page = Page(str(escape(suffix)).encode('utf-8').join(parts))
+        self._pages.put(key, page)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._parts.clear()
+        self._pages.clear()
+
+    def stats(self):
+        return self._pages.stats()
@@ -0,0 +1,188 @@
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, builds are only serialised within a process
+    fcntl = None
+
+from charts import ChartCache, ChartRenderPool
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE = 'report.html'
+MANIFEST_FILE = 'manifest.json'
+# Held for the whole of a build, so workers of one app can't build into the same directory at once
+LOCK_FILE = '.build.lock'
+CHARTS_DIR = 'charts'
+
+TEAM_CHART_TITLE = "Команда {0}"
+
+def _write_atomic(path, data):
+    # Readers (and the download route) never see half a file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+class ReportBusy(RuntimeError):
+    """Another process is building the report in the same directory"""
+
+@contextmanager
+def build_lock(directory):
+    """Exclusive lock on a report directory; ReportBusy if another process holds it"""
+    f = open(os.path.join(directory, LOCK_FILE), 'a')
+    try:
+        if fcntl:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise ReportBusy(f"A report is already being built in {directory}")
+        yield
+    finally:
+        f.close()
+
+def load_manifest(directory):
+    """What the previous build of the report in directory was made from, or None"""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def team_chart(survey, row):
+    """Categories, values (one decimal, like the dashboards) and title of a team's spider chart"""
+    categories = list(survey.raw['categories'])
+    # Categories without answers yet are drawn in the middle of the scale
+    values = [round(float(row['categories'].get(category) or 5), 1) for category in categories]
+    return categories, values, TEAM_CHART_TITLE.format(row['team_id'])
+
+def gap_roles(survey):
+    """Display names of the roles in the rows' gap column, or None if the config has no such pair"""
+    first, second = survey.gap_roles
+    if first not in survey.roles or second not in survey.roles:
+        return None
+    return survey.role_name(first), survey.role_name(second)
+
+def build_report(rows, survey, directory, render, workers=None, full=False):
+    """Write the cross-team report into directory; returns a summary of what was done.
+
+    rows are SurveySnapshot.team_comparison(*survey.gap_roles) rows and
+    render(**context) renders the page. The bundle is report.html, with every
+    chart embedded so the file can be passed around on its own, plus charts/
+    and manifest.json, which the next build reuses: chart files are named by
+    their content hash, so only teams whose averages moved (i.e. that got new
+    responses) are drawn again; full redraws everything. Charts are drawn in parallel in a render pool of its own,
+    so a build doesn't push the dashboards' charts out of their cache.
+    """
+    started = time.perf_counter()
+    charts_dir = os.path.join(directory, CHARTS_DIR)
+    os.makedirs(charts_dir, exist_ok=True)
+    with build_lock(directory):
+        previous = None if full else load_manifest(directory)
+        previous_teams = previous['teams'] if previous else {}
+
+        pool = ChartRenderPool(ChartCache(max_entries=0), workers)
+        keys = {}
+        futures = {}
+        try:
+            for row in rows:
+                categories, values, title = team_chart(survey, row)
+                labels = [survey.category_name(category) for category in categories]
+                key = ChartCache.make_key(values, categories, title, labels)
+                keys[row['team_id']] = key
+                if key not in futures and (full or not os.path.exists(os.path.join(charts_dir, key))):
+                    futures[key] = pool.submit(key, values, labels, title)
+            for key, future in futures.items():
+                _write_atomic(os.path.join(charts_dir, key), future.result())
+        finally:
+            pool.shutdown()
+
+        teams = []
+        for row in rows:
+            key = keys[row['team_id']]
+            with open(os.path.join(charts_dir, key), 'rb') as f:
+                chart = base64.b64encode(f.read()).decode()
+            before = previous_teams.get(str(row['team_id']))
+            # New since the previous build, or with responses it didn't have
+            changed = previous is not None and (before is None or
+                                                before['last_response_id'] != row['last_response_id'])
+            teams.append({**row,
+                          'response_count': sum(row['responses'].values()),
+                          'chart': chart,
+                          'changed': changed})
+        generated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        html = render(teams=teams,
+                      ranking=sorted((team for team in teams if team['index'] is not None),
+                                     key=lambda team: team['index'], reverse=True),
+                      categories=survey.raw['categories'],
+                      roles=survey.raw['roles'],
+                      gap_roles=gap_roles(survey),
+                      generated=generated,
+                      previous=previous['generated'] if previous else None)
+        _write_atomic(os.path.join(directory, REPORT_FILE), html.encode('utf-8'))
+
+        manifest = {'generated': generated,
+                    'config_version': survey.version,
+                    'teams': {str(row['team_id']): {'last_response_id': row['last_response_id'],
+                                                    'chart': keys[row['team_id']]} for row in rows}}
+        _write_atomic(os.path.join(directory, MANIFEST_FILE),
+                      json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+        # Charts of teams whose averages have changed since
+        used = set(keys.values())
+        for name in os.listdir(charts_dir):
+            if name not in used:
+                os.remove(os.path.join(charts_dir, name))
+
+        return {'path': os.path.join(directory, REPORT_FILE),
+                'generated': generated,
+                'teams': len(rows),
+                'changed': sum(team['changed'] for team in teams) if previous else len(rows),
+                'charts_rendered': len(futures),
+                'charts_reused': len(used) - len(futures),
+                'seconds': round(time.perf_counter() - started, 3)}
+
+class ReportJob:
+    """Runs report builds in a background thread, one at a time (across processes, see build_lock)"""
+    def __init__(self):
+        self.running = False
+        self.last = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def start(self, build):
+        """Run build() in the background; False if a build is already running"""
+        with self._lock:
+            if self.running:
+                return False
+            self.running = True
+        threading.Thread(target=self._run, args=(build,), name='report-build', daemon=True).start()
+        return True
+
+    def _run(self, build):
+        try:
+            summary = build()
+            error = None
+        except Exception as e:
+            logger.exception('Report build failed')
+            summary, error = None, repr(e)
+        with self._lock:
+            self.running = False
+            self.error = error
+            if summary is not None:
+                self.last = summary
+
+    def status(self):
+        with self._lock:
+            return {'running': self.running, 'last': self.last, 'error': self.error}
@@ -0,0 +1,104 @@
+import threading
+from io import BytesIO
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+from charts import CATEG_FORMAT, PNG_COMPRESS_LEVEL, PNG_PALETTE_COLORS, TITLE_FORMAT
+
+class SpiderChartTemplate:
+    """Polar axes, grid and ticks for a fixed number of categories, drawn once and reused.
+
+    Only the polygon, category labels and title change between charts. They are
+    marked animated, so the static background can be rendered once, kept as a
+    bitmap and restored before each chart instead of redrawing the whole figure.
+    PNGs are written as 8-bit palette images with a palette taken once from a
+    sample chart, which is both faster to encode and a third of the size of RGB.
+    """
+    def __init__(self, n_categories, dpi=100):
+        self.figure = Figure(figsize=(9, 7), dpi=dpi, facecolor='white')
+        self.canvas = FigureCanvasAgg(self.figure)
+        # Fixed margins leave room for the labels and title without a tight-bbox pass;
+        # the rectangle is square in pixels (420 x 420 at 100 dpi)
+        ax = self.figure.add_axes([0.2667, 0.12, 0.4667, 0.6], projection='polar')
+        self.ax = ax
+
+        # Compute angle for each axis and complete the loop
+        self.angles = np.linspace(0, 2 * np.pi, n_categories, endpoint=False)
+        self.closed_angles = np.append(self.angles, self.angles[:1])
+
+        ax.set_xticks(self.angles)
+        ax.set_xticklabels([])
+        ax.set_ylim(0, 10)
+        ax.set_yticks(range(0, 11, 2))
+        ax.set_yticklabels(map(str, range(0, 11, 2)), size=8)
+        ax.grid(True)
+
+        self.line, = ax.plot(self.closed_angles, np.zeros(n_categories + 1), 'o-',
+                             linewidth=2, color='blue', animated=True)
+        self.fill, = ax.fill(self.closed_angles, np.zeros(n_categories + 1),
+                             alpha=0.25, color='blue', animated=True)
+        self.labels = []
+        for angle in self.angles:
+            cos, sin = np.cos(angle), np.sin(angle)
+            self.labels.append(ax.text(angle, 11, '', size=10, animated=True,
+                                       ha='left' if cos > 0.1 else 'right' if cos < -0.1 else 'center',
+                                       va='bottom' if sin > 0.1 else 'top' if sin < -0.1 else 'center'))
+        self.title = ax.set_title('', size=15, y=1.1, animated=True)
+        self.dynamic_artists = [self.fill, self.line, *self.labels, self.title]
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.lock = threading.Lock()
+
+        self._update(np.linspace(2, 9, n_categories), ['Sample'] * n_categories, 'Sample')
+        self.palette = self._draw_png_frame().quantize(colors=PNG_PALETTE_COLORS,
+                                                       method=Image.Quantize.FASTOCTREE)
+
+    def _update(self, values, labels, title):
+        closed_values = np.append(values, values[:1])
+        self.line.set_ydata(closed_values)
+        self.fill.set_xy(np.column_stack([self.closed_angles, closed_values]))
+        for text, label, value in zip(self.labels, labels, values):
+            text.set_text(CATEG_FORMAT.format(label, f"{value:.1f}"))
+        # Same index as always: the mean over the closed loop, first value counted twice
+        self.title.set_text(TITLE_FORMAT.format(title, f"{closed_values.sum() / len(closed_values):.1f}"))
+
+    def _draw_png_frame(self):
+        self.canvas.restore_region(self.background)
+        for artist in self.dynamic_artists:
+            self.figure.draw_artist(artist)
+        return Image.frombuffer('RGBA', self.canvas.get_width_height(),
+                                self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+
+    def render(self, values, labels, title, fmt='png'):
+        with self.lock:
+            self._update(np.asarray(values, dtype=float), labels, title)
+            if fmt == 'png':
+                image = self._draw_png_frame().quantize(palette=self.palette, dither=Image.Dither.NONE)
+                output = BytesIO()
+                image.save(output, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+                return output.getvalue()
+
+            # Vector output can't reuse a bitmap; draw everything once
+            for artist in self.dynamic_artists:
+                artist.set_animated(False)
+            try:
+                output = BytesIO()
+                self.figure.savefig(output, format=fmt)
+                return output.getvalue()
+            finally:
+                for artist in self.dynamic_artists:
+                    artist.set_animated(True)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_template(n_categories, dpi=100):
+    key = (n_categories, dpi)
+    with _templates_lock:
+        if key not in _templates:
+            _templates[key] = SpiderChartTemplate(n_categories, dpi)
+        return _templates[key]
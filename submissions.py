@@ -0,0 +1,210 @@
+import glob
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, see SubmissionWriter
+    fcntl = None
+
+import database
+
+logger = logging.getLogger(__name__)
+
+class SubmissionWriter:
+    """Write-behind queue for survey submissions, group-committed by one background thread.
+
+    enqueue() appends the submission to this process's spool file and
+    returns; the writer thread inserts whatever has queued up meanwhile in a
+    single transaction, so a burst of submissions takes the SQLite write lock
+    a few times instead of once per form. The spool is flushed on every
+    submission, which, like the WAL with synchronous=NORMAL, survives the app
+    crashing but not the machine (fsync=True covers that too). It is emptied
+    whenever everything in it has been committed.
+
+    Each process spools to <pid>.spool and holds a lock on it; at start, spool
+    files nobody holds are taken over and their submissions queued again.
+    Responses are inserted with their unique submission key, so submissions
+    that were committed just before a crash are skipped. Without fcntl every
+    spool file is taken over, which is only right for a single process.
+    """
+    # Committed submission keys remembered for wait()
+    MAX_WRITTEN = 10000
+
+    def __init__(self, spool_dir, connect, batch_size=200, fsync=False, on_commit=None):
+        self.spool_dir = spool_dir
+        self.connect = connect
+        self.batch_size = batch_size
+        self.fsync = fsync
+        # Called with the writer's connection after each committed batch
+        self.on_commit = on_commit
+        self._queue = queue.Queue()
+        # Guards the spool file and the number of submissions in it not yet committed
+        self._spool_lock = threading.Lock()
+        self._spool = None
+        self._unwritten = 0
+        # key -> submission until committed; key -> response id after
+        self._done = threading.Condition()
+        self._pending = {}
+        self._written = OrderedDict()
+        self._thread = None
+
+    def start(self):
+        """Open the spool, queue submissions left over by dead processes and start writing"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f"{os.getpid()}.spool")
+        self._spool = open(path, 'a+', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # A previous process with the same pid may have left submissions here too
+        self._spool.seek(0)
+        leftovers = self._read_spool(self._spool)
+        claimed = []
+        for other in glob.glob(os.path.join(self.spool_dir, '*.spool')):
+            if os.path.abspath(other) == os.path.abspath(path):
+                continue
+            f = open(other, 'r', encoding='utf-8')
+            try:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()  # a live process's spool
+                continue
+            with f:
+                leftovers.extend(self._read_spool(f))
+            claimed.append(other)
+        # Rewrite them into our own spool before deleting the files they came from
+        with self._spool_lock:
+            self._spool.truncate(0)
+            for submission in leftovers:
+                self._spool.write(json.dumps(submission, ensure_ascii=False) + '\n')
+            self._sync()
+            self._unwritten = len(leftovers)
+        for other in claimed:
+            os.remove(other)
+        if leftovers:
+            logger.warning('Replaying %d spooled submissions', len(leftovers))
+        with self._done:
+            self._pending.update((submission['key'], submission) for submission in leftovers)
+        for submission in leftovers:
+            self._queue.put(submission)
+        self._thread = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _read_spool(f):
+        submissions = []
+        for line in f:
+            try:
+                submissions.append(json.loads(line))
+            except ValueError:
+                # The last line is cut short if the process died while writing it
+                logger.error('Skipping unreadable spooled submission: %r', line[:200])
+        return submissions
+
+    def _sync(self):
+        self._spool.flush()
+        if self.fsync:
+            os.fsync(self._spool.fileno())
+
+    def enqueue(self, submission):
+        """Spool a submission (a dict as database.insert_response takes) and queue it for writing"""
+        line = json.dumps(submission, ensure_ascii=False) + '\n'
+        with self._done:
+            self._pending[submission['key']] = submission
+        with self._spool_lock:
+            self._spool.write(line)
+            self._sync()
+            self._unwritten += 1
+        self._queue.put(submission)
+
+    def wait(self, key, timeout=None):
+        """Response id of a submission made through this writer, once committed.
+
+        None if the key isn't this process's or it isn't committed within timeout.
+        """
+        with self._done:
+            self._done.wait_for(lambda: key not in self._pending, timeout)
+            return self._written.get(key)
+
+    def pending(self):
+        """Number of submissions queued but not yet committed"""
+        with self._done:
+            return len(self._pending)
+
+    def close(self, timeout=None):
+        """Commit what is queued and stop the writer thread"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        conn = self.connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                # Everything that queued up during the previous commit goes in this one
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in batch
+                batch = [submission for submission in batch if submission is not None]
+                if batch:
+                    self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _insert(self, conn, batch):
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            return [(submission['key'], database.insert_response(cursor, submission)) for submission in batch]
+
+    def _commit(self, conn, batch):
+        delay = 0.1
+        while True:
+            try:
+                written = self._insert(conn, batch)
+                break
+            except sqlite3.OperationalError as e:
+                # Locked or busy past busy_timeout: the submissions are spooled, keep trying
+                logger.warning('Submission batch not written, retrying: %s', e)
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+            except sqlite3.DatabaseError:
+                # A submission the database rejects mustn't hold up the others
+                written = []
+                for submission in batch:
+                    try:
+                        written.extend(self._insert(conn, [submission]))
+                    except sqlite3.DatabaseError:
+                        logger.exception('Dropping submission %s', submission['key'])
+                        written.append((submission['key'], None))
+                break
+        with self._done:
+            for key, response_id in written:
+                self._pending.pop(key, None)
+                self._written[key] = response_id
+            while len(self._written) > self.MAX_WRITTEN:
+                self._written.popitem(last=False)
+            self._done.notify_all()
+        with self._spool_lock:
+            self._unwritten -= len(batch)
+            if not self._unwritten:
+                self._spool.truncate(0)
+        if self.on_commit:
+            try:
+                self.on_commit(conn)
+            except Exception:
+                logger.exception('on_commit failed')
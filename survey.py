@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import database
+from credentials import AdminUsers
+
+logger = logging.getLogger(__name__)
+
+class Question(NamedTuple):
+    id: int  # questions.id, stable across restarts and config edits
+    role: str
+    category: str
+    text: str
+    position: int  # order in the config, for sorting
+
+class CompiledSurvey:
+    """survey_config.json resolved once into ids and the lookups requests need.
+
+    Question ids come from the questions table, so ratings can reference them.
+    """
+    def __init__(self, raw, question_ids, version=None):
+        self.raw = raw
+        # config_versions.id, stamped on the responses filled in with this config
+        self.version = version
+        self.role_names = dict(raw['roles'])
+        self.category_names = dict(raw['categories'])
+        self.roles = [role for role in raw['roles'] if role in raw]
+        # role -> its categories in questionnaire order
+        self.role_categories = {role: list(raw[role]) for role in self.roles}
+        # (first, second) roles of the gap tables: gap_roles if the config has it, else its first two
+        # roles; (None, None) leaves the tables empty
+        gap_roles = raw.get('gap_roles') or self.roles[:2]
+        self.gap_roles = tuple(gap_roles) if len(gap_roles) == 2 else (None, None)
+
+        keys = self.question_keys(raw)
+        self.questions = {}
+        # (role, category, text) -> Question
+        self.by_key = {}
+        # role -> form field name (rating_<category>_<idx>) -> Question
+        self.rating_fields = {role: {} for role in self.roles}
+        for position, ((role, category, text), question_id, idx) in enumerate(
+                zip(keys, question_ids, self._field_indexes(raw))):
+            question = Question(question_id, role, category, text, position)
+            self.questions[question_id] = question
+            self.by_key[(role, category, text)] = question
+            self.rating_fields[role][f"rating_{category}_{idx}"] = question
+        # open field name -> question text
+        self.open_fields = {f"open_{idx}": question for idx, question in enumerate(raw['open_questions'])}
+
+    @staticmethod
+    def question_keys(raw):
+        """(role, category, question) of every rating question, in questionnaire order"""
+        return [(role, category, question)
+                for role in raw['roles'] if role in raw
+                for category, questions in raw[role].items()
+                for question in questions]
+
+    @staticmethod
+    def _field_indexes(raw):
+        return [idx
+                for role in raw['roles'] if role in raw
+                for questions in raw[role].values()
+                for idx in range(len(questions))]
+
+    def category_name(self, category):
+        return self.category_names.get(category, category)
+
+    def role_name(self, role):
+        return self.role_names.get(role, role)
+
+    def question_position(self, role, category, text):
+        """Questionnaire position of a question; ones no longer in the config sort last"""
+        question = self.by_key.get((role, category, text))
+        return question.position if question else len(self.questions)
+
+def config_digest(raw):
+    """Stored JSON text of a config and its hash; formatting doesn't matter, order does"""
+    config_json = json.dumps(raw, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(config_json.encode('utf-8')).hexdigest(), config_json
+
+def compile_survey(raw, conn):
+    """Compile a survey config, registering it and any new questions in the database"""
+    version = database.register_config_version(conn, *config_digest(raw))
+    return CompiledSurvey(raw, database.sync_questions(conn, CompiledSurvey.question_keys(raw)), version)
+
+class ConfigService:
+    """The current compiled survey and admin users, reloaded when their files change.
+
+    Files are polled by mtime, at most every check_interval seconds. A reload
+    builds the new objects completely before swapping the reference in, so a
+    request that already holds the previous survey finishes with it. A file
+    that doesn't parse or compile is logged and the previous config kept.
+    """
+    # Compiled versions kept for forms rendered before a reload
+    MAX_VERSIONS = 8
+
+    def __init__(self, survey_path, admins_path, connect, check_interval=2, auth_cache_ttl=300):
+        self.survey_path = survey_path
+        self.admins_path = admins_path
+        self.connect = connect
+        self.check_interval = check_interval
+        self.auth_cache_ttl = auth_cache_ttl
+        self.survey = None
+        self.users = AdminUsers({})
+        self._versions = {}
+        # path -> (mtime_ns, size) when last read
+        self._stamps = {}
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(survey) after a new survey config is swapped in"""
+        self._listeners.append(callback)
+        return callback
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read_json(self, path):
+        self._stamps[path] = self._stamp(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load_users(self):
+        self.users = AdminUsers(self._read_json(self.admins_path), self.auth_cache_ttl)
+
+    def _load_survey(self):
+        raw = self._read_json(self.survey_path)
+        conn = self.connect()
+        try:
+            survey = compile_survey(raw, conn)
+        finally:
+            conn.close()
+        self._remember(survey)
+        self.survey = survey
+
+    def _remember(self, survey):
+        self._versions[survey.version] = survey
+        while len(self._versions) > self.MAX_VERSIONS:
+            del self._versions[next(iter(self._versions))]
+
+    def load(self):
+        """Read both files now; errors propagate, as there is nothing to fall back to"""
+        with self._lock:
+            self._load_users()
+            self._load_survey()
+            self._checked_at = time.monotonic()
+
+    def check(self):
+        """Reload whichever files changed since they were read; True if the survey was swapped"""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return False
+        # Requests arriving during a reload carry on with the current config
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            previous = self.survey
+            for path, load in ((self.admins_path, self._load_users), (self.survey_path, self._load_survey)):
+                try:
+                    if self._stamp(path) != self._stamps.get(path):
+                        load()
+                except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                    # Not retried until the file changes again, e.g. when an editor finishes saving
+                    logger.error('Keeping the previous config, %s could not be loaded: %r', path, e)
+            swapped = self.survey is not previous and self.survey.version != previous.version
+        finally:
+            self._lock.release()
+        if swapped:
+            logger.info('Survey config version %s loaded', self.survey.version)
+            for callback in self._listeners:
+                callback(self.survey)
+        return swapped
+
+    def get(self, version=None):
+        """The compiled survey of a config version (e.g. from a submitted form), else the current one"""
+        survey = self.survey
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            return survey
+        if version == survey.version:
+            return survey
+        if version not in self._versions:
+            conn = self.connect()
+            try:
+                config_json = database.get_config_version(conn, version)
+                if config_json is None:
+                    return survey
+                with self._lock:
+                    self._remember(compile_survey(json.loads(config_json), conn))
+            finally:
+                conn.close()
+        return self._versions.get(version, survey)